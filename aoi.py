@@ -1,74 +1,69 @@
 
+import sys
+from typing import Tuple
 import cv2
+import numpy as np
 from context import FrameContext
 from debug import _debug
-from utils import Rect
+from utils import Rect, RectSet
 
 class AOI:
     def __init__(self, rect: Rect):
         self.rect = rect
         self.items : list[AOI] = [rect]
 
-    def group(self, rect: Rect):
-        newX = min(self.rect.x, rect.x)
-        newY = min(self.rect.y, rect.y)
-        newX2 = max(self.rect.x2(), rect.x2())
-        newW = newX2 - newX
-        newY2 = max(self.rect.y2(), rect.y2())
-        newH = newY2 - newY
-        self.rect = Rect([newX, newY, newW, newH])
-        self.items.append(rect)
-        self.items = sorted(self.items, key=lambda item: item.x)
+    @classmethod
+    def of(cls, rects: RectSet):
+        aoi = cls(rects.bounds())
+        aoi.items = rects.sort(rects.x).rects()
+        return aoi
 
 
-def find_aoi(ctx: FrameContext, image: cv2.Mat, minArea: int = 50, xThreshold: int = 100) -> list:
+EXTRACT_CONTOURS = 'contours'
+EXTRACT_COMPONENTS = 'components'
+
+def extract_boxes(image: cv2.Mat, minArea: int = 50, offset: Tuple[int, int] = (0, 0), method: str = EXTRACT_CONTOURS) -> RectSet:
+    # bounding boxes of the blobs larger than minArea, offset maps an image cropped out of the frame back to frame coordinates
+    if method == EXTRACT_COMPONENTS:
+        # areas and boxes of every blob from one call, the area is the pixel count (contourArea is the polygon area, 
+        # a little smaller) and label 0 is the background. It labels every pixel, so it pays off over findContours
+        # on frames with many blobs rather than on a few large ones, the block based labelling is the fastest of them
+        _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(image, 8, cv2.CV_32S, cv2.CCL_GRANA)
+        stats = stats[1:]
+        boxes = stats[stats[:, cv2.CC_STAT_AREA] > minArea, :4]
+        return RectSet(boxes + np.array([offset[0], offset[1], 0, 0], dtype=boxes.dtype))
+
     def filter_area(contours):
         for c in contours:
             if cv2.contourArea(c) > minArea:
                 yield c
 
     contours, _ = cv2.findContours( 
-        image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE) 
+        image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset) 
 
     contours = filter_area(contours)
 
-    boxes = [cv2.boundingRect(c) for c in contours]
-    
-    def is_same_row(rect1: Rect, rect2: Rect) -> bool:
-        return (rect2.y <= rect1.y and rect1.y <= rect2.y2()) or \
-            (rect1.y <= rect2.y and rect2.y <= rect1.y2())
+    return RectSet(np.array([cv2.boundingRect(c) for c in contours], dtype=np.int32))
 
-    def is_nearby_x(rect1: Rect, rect2: Rect) -> bool:
-        return abs(rect1.x2() - rect2.x) <= xThreshold or \
-            abs(rect2.x2() - rect1.x) <= xThreshold
+def find_aoi(ctx: FrameContext, image: cv2.Mat, minArea: int = 50, xThreshold: int = 100, offset: Tuple[int, int] = (0, 0), 
+             extract: str = EXTRACT_CONTOURS) -> list:
+    rects = extract_boxes(image, minArea, offset, extract)
     
-    # group into same row
-    boxes = sorted(boxes, key=lambda b: b[1])  
-
     def __debug_boxes():
         img = ctx.image.copy()
-        [cv2.rectangle(img, box, (255,255,255), 1) for box in boxes]
+        [cv2.rectangle(img, box, (255,255,255), 1) for box in rects.boxes.tolist()]
         ctx._write_step("boxes", img)
 
     _debug(ctx, lambda: __debug_boxes())
 
-    aoi_rows : list[AOI] = []
-    cur_row:AOI = None
-    for box in boxes:
-        rect = Rect(box)
+    return group_boxes(ctx, rects, xThreshold)
 
-        if not cur_row:
-            cur_row = AOI(rect)
-        else:
-            if is_same_row(cur_row.rect, rect):
-                cur_row.group(rect)
-            else:
-                aoi_rows.append(cur_row)
-                cur_row = AOI(rect)
-
-    aoi_rows.append(cur_row)
+def group_boxes(ctx: FrameContext, rects: RectSet, xThreshold: int = 100) -> list[AOI]:
+    # group into same row, one sort by y
+    rows = rects.rows()
 
     def __debug_rows():
+        aoi_rows : list[AOI] = [AOI.of(RectSet(rects.boxes[row])) for row in rows]
         img = ctx.image.copy()
         for i, row in enumerate(aoi_rows):
             cv2.rectangle(img, row.rect.to_list(), (255,255,255), 2)
@@ -83,26 +78,44 @@ def find_aoi(ctx: FrameContext, image: cv2.Mat, minArea: int = 50, xThreshold: i
 
     _debug(ctx, lambda: __debug_rows())
 
-    # group nearby boxes horizontally
+    if len(rows) == 0:
+        return []
+
+    # one sort by row then x, ties keep the y order of the rows pass
+    order = np.concatenate(rows)
+    labels = np.repeat(np.arange(len(rows)), [len(row) for row in rows])
+    swept = np.lexsort((rects.x[order], labels))
+
+    # group nearby boxes horizontally, sweeping each row left to right with the bounds of the
+    # current group kept as plain ints, this loop sees every speck of glare on the panel
     aois : list[AOI] = []
-    for row in aoi_rows:
-        rects = sorted(row.items, key=lambda b: b.x)
-        
-        cur_aoi: AOI = None
-        for rect in rects:
-            if not cur_aoi:
-                cur_aoi = AOI(rect)
-            else:
-                if is_nearby_x(cur_aoi.rect, rect):
-                    if cur_aoi.rect.overlapped(rect) > 0.8:
-                        _debug(ctx, lambda: print('skip overlapped rect'))
-                    else:
-                        cur_aoi.group(rect)
-                else:
-                    aois.append(cur_aoi)
-                    cur_aoi = AOI(rect)
-
-        aois.append(cur_aoi)
+    cur_aoi: AOI = None
+    cur_label = -1
+    x1 = y1 = x2 = y2 = 0
+    for label, box in zip(labels[swept].tolist(), rects.boxes[order[swept]].tolist()):
+        x, y, w, h = box
+        if label == cur_label and (abs(x2 - x) <= xThreshold or abs(x + w - x1) <= xThreshold):
+            # Rect.overlapped of the group and the box
+            inter_w = min(x2, x + w) - max(x1, x)
+            inter_h = min(y2, y + h) - max(y1, y)
+            if inter_w > 0 and inter_h > 0 and \
+                inter_w * inter_h / min((x2 - x1) * (y2 - y1), w * h) > 0.8:
+                _debug(ctx, lambda: print('skip overlapped rect', file=sys.stderr))
+                continue
+
+            cur_aoi.items.append(Rect(box))
+            x1, y1, x2, y2 = min(x1, x), min(y1, y), max(x2, x + w), max(y2, y + h)
+            continue
+
+        if cur_aoi:
+            cur_aoi.rect = Rect([x1, y1, x2 - x1, y2 - y1])
+            aois.append(cur_aoi)
+        cur_aoi = AOI(Rect(box))
+        cur_label = label
+        x1, y1, x2, y2 = x, y, x + w, y + h
+
+    cur_aoi.rect = Rect([x1, y1, x2 - x1, y2 - y1])
+    aois.append(cur_aoi)
 
     def __debug_aois():
         img = ctx.image.copy()
@@ -0,0 +1,64 @@
+import os
+import queue
+import sys
+import threading
+from multiprocessing import util
+from typing import Optional
+import cv2
+
+DEBUG_PNG = 'png'
+DEBUG_JPG = 'jpg'
+
+class ArtifactWriter:
+    def __init__(self, format: str = DEBUG_PNG, queue_size: int = 64):
+        self.format = format
+        # OpenCV's PNG defaults (fast RLE) beat any explicit compression level, JPEG is cheaper still
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, 90] if format == DEBUG_JPG else []
+
+        # bounded so a slow disk holds the detection back instead of piling up frames in memory
+        self.__queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+
+            path, image = item
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                cv2.imwrite(path, image, self.params)
+            except Exception as e:
+                print(f'failed to write {path}: {e}', file=sys.stderr)
+
+    def write(self, path: str, image: cv2.Mat):
+        # the image is encoded later, it must not be modified after it was queued
+        self.__queue.put((f'{path}.{self.format}', image))
+
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+
+_writer: Optional[ArtifactWriter] = None
+_writer_pid = 0
+
+def get_writer(format: str = DEBUG_PNG) -> ArtifactWriter:
+    # one writer thread per process, worker processes start their own
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = ArtifactWriter(format)
+        _writer_pid = os.getpid()
+
+        # worker processes skip atexit, multiprocessing finalizers still run when they exit
+        util.Finalize(None, _writer.close, exitpriority=10)
+
+    return _writer
+
+def close_writer():
+    global _writer
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.close()
+        _writer = None
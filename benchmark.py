@@ -0,0 +1,219 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable
+import cv2
+import numpy as np
+
+from aoi import EXTRACT_COMPONENTS, EXTRACT_CONTOURS, extract_boxes, group_boxes
+from context import Context
+from main import build_parser
+from panel import DEFAULT_PROFILE
+from skywalker import SkyWalker
+from ssd import SSD
+from synthetic import GLYPHS, Panel, render_digit, render_panel
+from timing import TimingReport
+from utils import allocations, print_table
+from video import DECODE_SEEK, DECODE_SEQUENTIAL, choose_strategy, open_video, seek_frames, sequential_frames
+
+def _context(*args: str) -> Context:
+    output_path = os.path.join(tempfile.gettempdir(), 'skylogger-bench')
+    return Context(build_parser().parse_args(['', output_path, '--rotate=0', *args]))
+
+def _time_decode(path: str, reader: Callable, start: int, interval: int, count: int) -> tuple[int, float]:
+    video = open_video(path)
+
+    t1 = time.perf_counter()
+    samples = 0
+    for _ in reader(video, start, interval):
+        samples += 1
+        if count > 0 and samples >= count:
+            break
+    elapsed = time.perf_counter() - t1
+
+    video.release()
+    return samples, elapsed
+
+def bench_decode(args: argparse.Namespace):
+    readers = {
+        DECODE_SEEK: seek_frames,
+        DECODE_SEQUENTIAL: sequential_frames,
+    }
+
+    video = open_video(args.input_path)
+    auto = {interval: choose_strategy(video, interval) for interval in args.intervals}
+    video.release()
+
+    rows = []
+    for interval in args.intervals:
+        for name, reader in readers.items():
+            samples, elapsed = _time_decode(args.input_path, reader, args.skip, interval, args.count)
+            rate = round(samples / elapsed, 2) if elapsed > 0 else 0
+            rows.append([interval, name, samples, round(elapsed, 3), rate, '*' if auto[interval] == name else ''])
+
+    print_table(['interval', 'strategy', 'samples', 'seconds', 'samples/sec', 'auto'], rows)
+
+def bench_ssd(args: argparse.Namespace):
+    rng = np.random.default_rng(args.seed)
+
+    samples: list[tuple[str, np.ndarray]] = []
+    for char in GLYPHS:
+        if char == ' ':
+            continue
+        for height in args.heights:
+            image = render_digit(char, int(height * 0.62), height, margin=2)
+            image = np.clip(image + rng.normal(0, args.noise, image.shape), 0, 255).astype(np.uint8)
+            samples.append((char, image))
+
+    engines = ['contour', 'mask']
+    outputs: dict[str, list] = {}
+    rows = []
+    for engine in engines:
+        ctx = _context(f'--ssd-engine={engine}').new_frame_context('bench', None)
+
+        t1 = time.perf_counter()
+        for _ in range(args.repeat):
+            outputs[engine] = [SSD().detect(ctx, 'bench', i, image) for i, (_, image) in enumerate(samples)]
+        elapsed = time.perf_counter() - t1
+
+        correct = sum(1 for (char, _), res in zip(samples, outputs[engine]) if res == char)
+        usec = round(elapsed / (args.repeat * len(samples)) * 1e6, 1)
+        rows.append([engine, len(samples), usec, f'{correct / len(samples):.1%}'])
+
+    agreement = sum(1 for res1, res2 in zip(outputs['contour'], outputs['mask']) if res1 == res2) / len(samples)
+
+    print_table(['engine', 'digits', 'usec/digit', 'accuracy'], rows)
+    print(f'agreement: {agreement:.1%}')
+    for name, info in SSD.cache_info().items():
+        print(f'{name} cache: {info}')
+
+def _panel(i: int) -> Panel:
+    # a roast in fast forward from 12:00, every frame is a second later and a degree hotter
+    modes = ['PREHEAT', 'ROAST', 'COOL']
+    return Panel(temperature=str(150 + i % 100),
+                 power=str(80 + 5 * (i // 20 % 3)),
+                 time=f'{(12 + i // 60) % 60:02d}{i % 60:02d}',
+                 mode=modes[i // 50 % len(modes)])
+
+def bench_pipeline(args: argparse.Namespace):
+    ctx = _context(f'--ssd-engine={args.ssd_engine}', f'--layout-lock={args.layout_lock}', f'--coarse-scale={args.coarse_scale}',
+                   f'--aoi-extract={args.aoi_extract}', f'--panel={args.panel}', '--profile')
+
+    panels = [_panel(i) for i in range(args.frames)]
+    images = [render_panel(panel, args.digit_height, args.size, noise=args.noise, blur=args.blur, glare=args.glare, seed=args.seed + i) 
+              for i, panel in enumerate(panels)]
+
+    report = TimingReport()
+    fields = ['temperature', 'profile', 'power', 'fan', 'time', 'mode']
+    correct = {field: 0 for field in fields}
+    frames_correct = 0
+    extracted = {'views': 0, 'copies': 0, 'bytes': 0}
+
+    t1 = time.perf_counter()
+    for i, (panel, image) in enumerate(zip(panels, images)):
+        frame_ctx = ctx.new_frame_context(f'frame_{i}', image)
+        allocations.reset()
+        with frame_ctx.timer.stage('frame'):
+            res = SkyWalker(frame_ctx).detect()
+        report.add(frame_ctx.name, frame_ctx.timer.spans)
+        for key, value in allocations.info().items():
+            extracted[key] += value
+
+        expected = {
+            'temperature': int(panel.temperature),
+            'profile': panel.profile,
+            'power': int(panel.power),
+            'fan': int(panel.fan),
+            'time': int(panel.time[:2]) * 60 + int(panel.time[2:]),
+            'mode': panel.mode,
+        }
+        matches = {field: res is not None and getattr(res, field) == value for field, value in expected.items()}
+        for field, match in matches.items():
+            correct[field] += match
+        frames_correct += all(matches.values())
+    elapsed = time.perf_counter() - t1
+
+    print(f'frames: {args.frames}, {args.frames / elapsed:.1f} frames/sec, accuracy: {frames_correct / args.frames:.1%}')
+    print_table(fields, [[f'{correct[field] / args.frames:.1%}' for field in fields]])
+    print(f'image extractions per frame: {extracted["views"] / args.frames:.1f} views, '
+          f'{extracted["copies"] / args.frames:.1f} copies ({extracted["bytes"] / args.frames / 1024:.1f} KiB)')
+    print()
+    report.print_summary()
+
+def _specks(count: int, size: tuple[int, int], rng: np.random.Generator) -> np.ndarray:
+    # a binary frame of glare specks, a few pixels wide and scattered over the whole frame
+    image = np.zeros((size[1], size[0]), dtype=np.uint8)
+    for x, y, w, h in zip(rng.integers(0, size[0], count), rng.integers(0, size[1], count), 
+                          rng.integers(8, 16, count), rng.integers(8, 16, count)):
+        cv2.rectangle(image, (int(x), int(y)), (int(x + w), int(y + h)), 255, -1)
+    return image
+
+def bench_aoi(args: argparse.Namespace):
+    ctx = _context().new_frame_context('bench', None)
+    rng = np.random.default_rng(args.seed)
+
+    rows = []
+    for count in args.counts:
+        image = _specks(count, args.size, rng)
+
+        for method in [EXTRACT_CONTOURS, EXTRACT_COMPONENTS]:
+            t1 = time.perf_counter()
+            for _ in range(args.repeat):
+                rects = extract_boxes(image, args.min_area, method=method)
+            extraction = (time.perf_counter() - t1) / args.repeat
+
+            t1 = time.perf_counter()
+            for _ in range(args.repeat):
+                aois = group_boxes(ctx, rects, args.x_threshold)
+            grouping = (time.perf_counter() - t1) / args.repeat
+
+            usec = round(grouping / max(len(rects), 1) * 1e6, 2)
+            rows.append([count, method, len(rects), len(aois), round(extraction * 1e3, 3), round(grouping * 1e3, 3), usec])
+
+    print_table(['specks', 'extract', 'boxes', 'aois', 'extract msec', 'grouping msec', 'grouping usec/box'], rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Skylogger benchmarks.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    decode_parser = subparsers.add_parser('decode', help="Compare seek and sequential frame decoding.")
+    decode_parser.add_argument('input_path', type=str, help="Path to the input video file.")
+    decode_parser.add_argument('--intervals', type=lambda s: [int(v) for v in s.split(',')], default=[1, 2, 5, 10, 30], help="Comma separated sampling intervals in seconds.")
+    decode_parser.add_argument('--skip', type=int, default=0, help="Skip number of seconds.")
+    decode_parser.add_argument('--count', type=int, default=0, help="Number of samples per run (0 for the whole video).")
+    decode_parser.set_defaults(func=bench_decode)
+
+    ssd_parser = subparsers.add_parser('ssd', help="Compare the seven segment classifier engines on synthetic digits.")
+    ssd_parser.add_argument('--heights', type=lambda s: [int(v) for v in s.split(',')], default=[40, 60, 80, 100], help="Comma separated digit heights.")
+    ssd_parser.add_argument('--noise', type=float, default=6, help="Gaussian noise sigma.")
+    ssd_parser.add_argument('--repeat', type=int, default=20, help="Number of passes over the digits.")
+    ssd_parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+    ssd_parser.set_defaults(func=bench_ssd)
+
+    pipeline_parser = subparsers.add_parser('pipeline', help="Measure SkyWalker.detect speed and accuracy on synthetic panel frames.")
+    pipeline_parser.add_argument('--frames', type=int, default=100, help="Number of frames.")
+    pipeline_parser.add_argument('--size', type=lambda s: tuple(int(v) for v in s.split('x')), default=(1920, 1080), help="Frame size (e.g. 3840x2160).")
+    pipeline_parser.add_argument('--digit-height', type=int, default=80, help="Digit height in pixels.")
+    pipeline_parser.add_argument('--noise', type=float, default=3, help="Gaussian noise sigma.")
+    pipeline_parser.add_argument('--blur', type=int, default=0, help="Gaussian blur radius.")
+    pipeline_parser.add_argument('--glare', type=float, default=0, help="Glare strength (0-1).")
+    pipeline_parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+    pipeline_parser.add_argument('--ssd-engine', type=str, default='contour', choices=['contour', 'mask'], help="Seven segment classifier.")
+    pipeline_parser.add_argument('--layout-lock', type=int, default=3, help="Reuse the display layout after N consistent frames (0 to disable).")
+    pipeline_parser.add_argument('--coarse-scale', type=float, default=0, help="Locate the panel on a downscaled frame first (0 to disable).")
+    pipeline_parser.add_argument('--aoi-extract', type=str, default='contours', choices=['contours', 'components'], help="Display candidate extraction.")
+    pipeline_parser.add_argument('--panel', type=str, default=DEFAULT_PROFILE, help="Panel profile JSON.")
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    aoi_parser = subparsers.add_parser('aoi', help="Measure the find_aoi extraction and grouping on synthetic frames full of glare specks.")
+    aoi_parser.add_argument('--counts', type=lambda s: [int(v) for v in s.split(',')], default=[10, 100, 1000, 10000], help="Comma separated speck counts.")
+    aoi_parser.add_argument('--size', type=lambda s: tuple(int(v) for v in s.split('x')), default=(3840, 2160), help="Frame size (e.g. 1920x1080).")
+    aoi_parser.add_argument('--min-area', type=int, default=50, help="Smallest contour area.")
+    aoi_parser.add_argument('--x-threshold', type=int, default=100, help="Horizontal grouping distance.")
+    aoi_parser.add_argument('--repeat', type=int, default=10, help="Number of runs per count.")
+    aoi_parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+    aoi_parser.set_defaults(func=bench_aoi)
+
+    args = parser.parse_args()
+    args.func(args)
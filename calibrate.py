@@ -0,0 +1,144 @@
+import argparse
+import math
+import os
+import tempfile
+from typing import Iterator, Tuple
+import cv2
+import numpy as np
+
+from aoi import find_aoi
+from context import Context
+from main import VIDEO_EXTENSIONS, build_parser
+from panel import DEFAULT_PROFILE, PanelProfile, Section, load_profile
+from utils import RectSet, find_central_box_index, print_table, rotate_image
+
+# angle (degrees), length ratio and digit count of a section seen on one frame
+Measure = Tuple[float, float, int]
+
+def sample_frames(path: str, samples: int) -> Iterator[Tuple[str, cv2.Mat]]:
+    # images as they are, videos at evenly spaced points
+    if not path.lower().endswith(VIDEO_EXTENSIONS):
+        image = cv2.imread(path)
+        if image is None:
+            print(f'failed to read {path}')
+            return
+        yield os.path.basename(path), image
+        return
+
+    video = cv2.VideoCapture(path)
+    frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    for i in range(samples):
+        pos = frames * (2 * i + 1) // (2 * samples)
+        video.set(cv2.CAP_PROP_POS_FRAMES, pos)
+        ret, frame = video.read()
+        if ret:
+            yield f'{os.path.basename(path)}-{pos}', frame
+    video.release()
+
+def measure_sections(ctx: Context, profile: PanelProfile, name: str, image: cv2.Mat, tolerance: float) -> dict[str, Measure]:
+    frame_ctx = ctx.new_frame_context(name, image, use_layout=False)
+    aois = find_aoi(frame_ctx, frame_ctx.images.dilate(profile.dilate_kernel), profile.min_area, profile.x_threshold)
+    if len(aois) == 0:
+        return {}
+
+    rects = RectSet.from_rects([aoi.rect for aoi in aois])
+    cidx = find_central_box_index(rects)
+    power = aois[cidx]
+    origin = power.rect.projected().center()
+    height = power.rect.h
+    centers = rects.projected().centers()
+
+    # every section claims the nearest display to where the profile expects it, closest pairs first
+    pairs = []
+    for section in profile.sections.values():
+        if section.name == 'POWER':
+            continue
+
+        x, y = profile.project(section, origin, height)
+        distances = np.hypot(centers[:, 0] - x, centers[:, 1] - y)
+        pairs += [(distance, section.name, idx) for idx, distance in enumerate(distances.tolist())
+                  if idx != cidx and distance <= tolerance * height]
+
+    measured: dict[str, Measure] = {'POWER': (0.0, 0.0, len(power.items))}
+    claimed = {cidx}
+    for _, section_name, idx in sorted(pairs):
+        if section_name in measured or idx in claimed:
+            continue
+
+        dx, dy = centers[idx] - origin
+        measured[section_name] = (math.degrees(math.atan2(dy, dx)), math.hypot(dx, dy) / height, len(aois[idx].items))
+        claimed.add(idx)
+
+    return measured
+
+def calibrate(profile: PanelProfile, measures: dict[str, list[Measure]], name: str) -> PanelProfile:
+    sections: list[Section] = []
+    for section in profile.sections.values():
+        seen = measures.get(section.name, [])
+        if section.name == 'POWER' or len(seen) == 0:
+            sections.append(Section(section.name, section.angle, section.length, section.skip_detect, section.digits, section.colon))
+            continue
+
+        # mean direction on the circle, the angles of TIME and TEMPERATURE sit around +-180
+        angle = math.degrees(math.atan2(sum(math.sin(math.radians(m[0])) for m in seen),
+                                        sum(math.cos(math.radians(m[0])) for m in seen)))
+        length = sum(m[1] for m in seen) / len(seen)
+        # leading zeros are blank and the colon dots are separate blobs, so only the most digits seen counts
+        digits = section.digits if section.skip_detect or section.colon else max(m[2] for m in seen)
+
+        sections.append(Section(section.name, round(angle, 2), round(length, 2), section.skip_detect, digits, section.colon))
+
+    return PanelProfile(name, sections, profile.glyphs, profile.threshold, profile.dilate_kernel, profile.digit_kernel,
+                        profile.min_area, profile.x_threshold)
+
+def main(args: argparse.Namespace):
+    try:
+        base = load_profile(args.base)
+    except (OSError, ValueError) as e:
+        print(f"Invalid panel profile {args.base}: {e}")
+        return
+
+    output_path = os.path.join(tempfile.gettempdir(), 'skylogger-calibrate')
+    ctx = Context(build_parser().parse_args(['', output_path, '--rotate=0', '--layout-lock=0', f'--panel={args.base}']))
+
+    measures: dict[str, list[Measure]] = {}
+    frames = 0
+    for path in args.input_paths:
+        for name, image in sample_frames(path, args.samples):
+            measured = measure_sections(ctx, base, name, rotate_image(image, args.rotate), args.tolerance)
+            if len(measured) <= 1:
+                print(f'{name} displays not found')
+                continue
+
+            frames += 1
+            for section_name, measure in measured.items():
+                measures.setdefault(section_name, []).append(measure)
+
+    if frames == 0:
+        print('no frame to calibrate from')
+        return
+
+    name = args.name or os.path.splitext(os.path.basename(args.output))[0]
+    profile = calibrate(base, measures, name)
+    profile.save(args.output)
+
+    rows = []
+    for section in profile.sections.values():
+        old = base.sections[section.name]
+        rows.append([section.name, len(measures.get(section.name, [])),
+                     f'{old.angle} -> {section.angle}', f'{old.length} -> {section.length}', f'{old.digits} -> {section.digits}'])
+
+    print(f'{frames} frames, profile written to {args.output}')
+    print_table(['section', 'frames', 'angle', 'length', 'digits'], rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive a panel profile from sample frames of a roaster.")
+    parser.add_argument('input_paths', type=str, nargs='+', help="Sample images or videos of the panel, upright and with the displays lit.")
+    parser.add_argument('--output', type=str, required=True, help="Path of the profile JSON to write.")
+    parser.add_argument('--base', type=str, default=DEFAULT_PROFILE, help="Profile to start from, its sections name the displays found.")
+    parser.add_argument('--name', type=str, default=None, help="Profile name (defaults to the output file name).")
+    parser.add_argument('--samples', type=int, default=5, help="Number of frames sampled from every video.")
+    parser.add_argument('--rotate', type=int, default=0, help="Rotate the samples by this many degrees.")
+    parser.add_argument('--tolerance', type=float, default=1.0, help="Furthest a display may be from where the base profile expects it, in POWER display heights.")
+
+    main(parser.parse_args())
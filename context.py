@@ -1,7 +1,16 @@
 import csv
+import json
 import os
+import sys
 import cv2
 import argparse
+from typing import Callable, Optional
+
+from artifacts import get_writer
+from layout import LayoutCache
+from panel import load_profile
+from timing import StageTimer
+from utils import Rect
 
 class Settings:
     def __init__(self, input_path: str, output_path: str):
@@ -13,27 +22,116 @@ class Options:
         self.skip = args.skip 
         self.count = args.count 
         self.interval = args.interval
+        self.max_interval = args.max_interval
+        self.temporal = args.temporal
+        self.decode = args.decode
+        self.workers = args.workers
         self.rotate = args.rotate
         self.debug = args.debug
+        self.debug_every = max(1, args.debug_every)
+        self.debug_format = args.debug_format
+        self.debug_on_failure = args.debug_on_failure
+        self.layout_lock = args.layout_lock
+        self.layout_revalidate = args.layout_revalidate
+        self.ssd_engine = args.ssd_engine
+        self.coarse_scale = args.coarse_scale
+        self.aoi_extract = args.aoi_extract
+        self.panel = load_profile(args.panel)
+        self.resume = args.resume
+        self.output = args.output
+        self.batch_size = args.batch_size
+        self.profile = args.profile or args.trace is not None
+        self.trace = args.trace
+        self.live = args.live
+        self.loop = args.loop
+        self.latency = args.latency
+        self.buffer_size = args.buffer_size
         
+class FrameImages:
+    __kernels: dict[int, cv2.Mat] = {}
+
+    def __init__(self, image: cv2.Mat, level: int = 200):
+        self.image = image
+        # binarization level of the panel profile
+        self.level = level
+        self.region: Optional[Rect] = None
+        self.__cache: dict[tuple, cv2.Mat] = {}
+
+    def __get(self, key: tuple, fn: Callable[[], cv2.Mat]) -> cv2.Mat:
+        if key not in self.__cache:
+            self.__cache[key] = fn()
+
+        return self.__cache[key]
+
+    @classmethod
+    def kernel(cls, ksize: int) -> cv2.Mat:
+        if ksize not in cls.__kernels:
+            cls.__kernels[ksize] = cv2.getStructuringElement(cv2.MORPH_RECT, (ksize, ksize))
+
+        return cls.__kernels[ksize]
+
+    def restrict(self, rect: Rect):
+        # only derive images inside rect (e.g. a cached display layout) instead of the whole frame
+        x = max(rect.x, 0)
+        y = max(rect.y, 0)
+        self.region = Rect([x, y, rect.x2() - x, rect.y2() - y])
+        self.__cache.clear()
+
+    def unrestrict(self):
+        self.region = None
+        self.__cache.clear()
+
+    def crop(self, image: cv2.Mat, rect: Rect) -> cv2.Mat:
+        # zero-copy view of a derived image in frame coordinates
+        ox, oy = (self.region.x, self.region.y) if self.region is not None else (0, 0)
+        x = max(rect.x - ox, 0)
+        y = max(rect.y - oy, 0)
+        return image[y:max(rect.y2() - oy, 0), x:max(rect.x2() - ox, 0)]
+
+    def gray(self) -> cv2.Mat:
+        def __gray() -> cv2.Mat:
+            image = self.image
+            if self.region is not None:
+                image = image[self.region.y:self.region.y2(), self.region.x:self.region.x2()]
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        return self.__get(('gray',), __gray)
+
+    def threshold(self, level: Optional[int] = None) -> cv2.Mat:
+        level = self.level if level is None else level
+        return self.__get(('threshold', level), 
+                          lambda: cv2.threshold(self.gray(), level, 255, cv2.THRESH_BINARY)[1])
+
+    def dilate(self, ksize: int, level: Optional[int] = None) -> cv2.Mat:
+        # same as thresholding the dilated gray image, the threshold is monotonic
+        level = self.level if level is None else level
+        return self.__get(('dilate', ksize, level), 
+                          lambda: cv2.dilate(self.threshold(level), FrameImages.kernel(ksize), iterations=1))
+
+    def binary(self, rect: Rect, level: Optional[int] = None) -> cv2.Mat:
+        return self.crop(self.threshold(level), rect)
+
 class FrameContext:
-    def __init__(self, name: str, image: cv2.Mat, options: Options, debug_path: str):
+    def __init__(self, name: str, image: cv2.Mat, options: Options, debug_path: str, layout: Optional[LayoutCache] = None, debug: Optional[bool] = None):
         self.name = name
         self.options = options
+        # debug output of this frame, --debug-every samples the frames that write it
+        self.debug = options.debug if debug is None else debug
         self.image = image
+        self.images = FrameImages(image, options.panel.threshold)
+        self.layout = layout
+        self.timer = StageTimer(options.profile)
 
         self.__step_counter = 1
 
-        if self.options.debug:
-            self.__debug_dir = os.path.join(debug_path, name)
-            os.makedirs(self.__debug_dir, exist_ok=True)
+        self.__debug_dir = os.path.join(debug_path, name)
 
     def _write_step(self, filename: str, image: cv2.Mat):
-        if not self.options.debug:
+        if not self.debug:
             return
 
-        output_path = os.path.join(self.__debug_dir, f'{self.__step_counter}-{filename}.png')
-        cv2.imwrite(output_path, image)
+        output_path = os.path.join(self.__debug_dir, f'{self.__step_counter}-{filename}')
+        get_writer(self.options.debug_format).write(output_path, image)
         self.__step_counter += 1
 
     
@@ -47,7 +145,43 @@ class Context:
         self.__debug_path = ''
         if self.options.debug:
             self.__debug_path = os.path.join(self.settings.output_path, '_debug')
-        
 
-    def new_frame_context(self, name: str, image: cv2.Mat):
-        return FrameContext(name, image, self.options, self.__debug_path)
+        self.layout: Optional[LayoutCache] = None
+        if self.options.layout_lock > 0:
+            self.layout = LayoutCache(self.options.layout_lock, self.options.layout_revalidate)
+
+        self.rotation: Optional[int] = None
+        if self.options.rotate.isdigit():
+            self.rotation = int(self.options.rotate)
+        elif self.options.rotate == 'auto':
+            self.rotation = self.__load_sidecar().get('rotate')
+
+    def __sidecar_path(self) -> str:
+        return f'{self.settings.input_path}.skylogger.json'
+
+    def __load_sidecar(self) -> dict:
+        try:
+            with open(self.__sidecar_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_rotation(self, degree: int):
+        self.rotation = degree
+
+        sidecar = self.__load_sidecar()
+        sidecar['rotate'] = degree
+        try:
+            with open(self.__sidecar_path(), 'w') as f:
+                json.dump(sidecar, f)
+        except OSError as e:
+            print(f'failed to write sidecar {self.__sidecar_path()}: {e}', file=sys.stderr)
+
+    def sample_debug(self, seq: int) -> bool:
+        return self.options.debug and seq % self.options.debug_every == 0
+
+    def new_frame_context(self, name: str, image: cv2.Mat, debug: Optional[bool] = None, debug_path: Optional[str] = None, use_layout: bool = True):
+        return FrameContext(name, image, self.options, 
+                            debug_path if debug_path is not None else self.__debug_path, 
+                            self.layout if use_layout else None, 
+                            debug)
@@ -75,5 +75,5 @@ def _debug_displays(ctx: FrameContext, rects: dict[str, Rect]):
     ctx._write_step('displays', img)
 
 def _debug(ctx: FrameContext, fn: Callable):
-    if ctx.options.debug:
+    if ctx.debug:
         fn()
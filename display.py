@@ -1,5 +1,6 @@
 
-from typing import Tuple
+import sys
+from typing import Optional, Tuple
 
 import cv2
 from context import FrameContext
@@ -22,6 +23,13 @@ class Digit:
     def __extract_image(self):
         self.__image = self.rect.extract_image(self.ctx.image)
 
+    def image(self) -> cv2.Mat:
+        return self.__image
+
+    def binary(self) -> cv2.Mat:
+        # view into the frame level threshold image shared by every digit
+        return self.ctx.images.binary(self.rect)
+
     def fix_size(self, width: int, height: int):
         orig_rect = self.rect
         
@@ -39,24 +47,41 @@ class Digit:
             newy = int(orig_rect.y - (height - orig_rect.h) / 2)
 
         new_rect = Rect([newx, newy, width, height])
-        # self.__image = self.ctx.image.copy()[new_rect.y:new_rect.y+new_rect.h, new_rect.x:new_rect.x+new_rect.w]
         self.__image = new_rect.extract_image(self.ctx.image)
         self.rect = new_rect
 
-    def detect(self) -> str:
-        res = SSD().detect(self.ctx, self.name, self.index, self.__image)
-        if not res and self.sliding:
-            x, y, w, h = self.rect.to_list()
-            while x <= (self.max_width - w):
-                newDigit = Digit(self.ctx, self.name, self.index, Rect([x, y, w, h]))
-                res = newDigit.detect()
-                if res is None:
-                    x += 2
-                    continue
-                break
+    def __slide(self) -> Optional[str]:
+        # score every offset of the window over the merged strip in one pass and keep the best one,
+        # with some slack around the estimated position as the colon gap varies
+        x, y, w, h = self.rect.to_list()
+        slack = w // 4
+        strip = Rect([max(x - slack, 0), y, 0, h])
+        strip.w = max(self.max_width, x + w) + slack - strip.x
+        binary = self.ctx.images.binary(strip)
+        if binary.size == 0:
+            return None
+
+        panel = self.ctx.options.panel
+        processed = SSD.preprocess(binary, panel.threshold, panel.digit_kernel)
+
+        res, offset = SSD().search(self.ctx, self.name, self.index, processed, w)
+        _debug(self.ctx, lambda: print(f'{self.ctx.name}-{self.name}-{self.index}: sliding offset {offset} {res}', file=sys.stderr))
 
         return res
 
+    def detect(self) -> Optional[str]:
+        # None when the digit is not recognized, or lies outside the frame after fix_size
+        if self.sliding:
+            with self.ctx.timer.stage('ssd_search'):
+                return self.__slide()
+
+        binary = self.binary()
+        if binary.size == 0:
+            return None
+
+        panel = self.ctx.options.panel
+        return SSD().classify(self.ctx, self.name, self.index, self.__image, SSD.preprocess(binary, panel.threshold, panel.digit_kernel))
+
 class Display:
     def __init__(self, ctx: FrameContext, name: str, rect: Rect, digits: list[Digit]):
         self.ctx = ctx
@@ -95,7 +120,7 @@ class Display:
             self.digits = new_digits
 
         if len(self.digits) == 3: # case where 01:23 1:2 merged in a digit zone
-            _debug(self.ctx, lambda: print(f'{self.ctx.name}-{self.name}: splitting digit'))
+            _debug(self.ctx, lambda: print(f'{self.ctx.name}-{self.name}: splitting digit', file=sys.stderr))
 
             new_digits: list[Rect] = [self.digits[0]]
             digit = self.digits[1]
@@ -133,7 +158,7 @@ class Display:
 
             # if not -
             if digit.rect.h >= 0.8 * height:
-                _debug(self.ctx, lambda: print(f'{self.ctx.name}-{self.name}: fixing digit 1 width'))
+                _debug(self.ctx, lambda: print(f'{self.ctx.name}-{self.name}: fixing digit 1 width', file=sys.stderr))
 
                 new_digits: list[Rect] = [self.digits[0]]
 
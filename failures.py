@@ -0,0 +1,90 @@
+from collections import deque
+from typing import Iterator, Optional, Tuple
+import cv2
+
+from skywalker import Result
+
+# largest temperature change between two frames, plus what the roast can add per displayed second
+TEMPERATURE_STEP = 20
+TEMPERATURE_RATE = 2
+
+def implausible_jump(prev: Result, cur: Result) -> Optional[str]:
+    # prev is the frame read right before cur
+    if prev.mode != cur.mode:
+        # the timer restarts and the temperature swings with a new roast phase
+        return None
+
+    dt = cur.time - prev.time
+    if dt < 0:
+        return f'time went back from {prev.time} to {cur.time}'
+
+    if abs(cur.temperature - prev.temperature) > TEMPERATURE_STEP + TEMPERATURE_RATE * dt:
+        return f'temperature jumped from {prev.temperature} to {cur.temperature} in {dt} sec'
+
+    return None
+
+class FailureMonitor:
+    def __init__(self, size: int, workers: int = 1, cooldown: Optional[int] = None):
+        self.size = size
+        # frames after a persisted failure whose failures are only counted, a run of bad frames (glare, 
+        # a moved camera) is written once instead of once per frame
+        self.cooldown = size if cooldown is None else cooldown
+        self.suppressed = 0
+        self.__last: Optional[int] = None
+        # frames already written with an earlier failure
+        self.__saved: set[int] = set()
+
+        # references to the last decoded frames, with room for the frames still in flight in the workers
+        self.__frames: deque[Tuple[int, str, cv2.Mat]] = deque(maxlen=size + workers * 2)
+        self.__results: dict[int, Result] = {}
+
+    def track(self, frames: Iterator[Tuple[int, int, cv2.Mat]]) -> Iterator[Tuple[int, int, cv2.Mat]]:
+        for seq, cur_sec, frame in frames:
+            self.__frames.append((seq, f'frame_{cur_sec}', frame))
+            yield seq, cur_sec, frame
+
+    def check(self, seq: int, res: Optional[Result]) -> Optional[Tuple[int, str]]:
+        # the failed frame and why
+        if res is None:
+            return self.__failure(seq, 'display not found')
+
+        if not res.is_valid():
+            return self.__failure(seq, ', '.join(res.error_messages()))
+
+        # results can arrive out of order, compare with whichever neighbour is already known
+        self.__results[seq] = res
+        for key in [key for key in self.__results if key < seq - self.__frames.maxlen]:
+            del self.__results[key]
+
+        prev = self.__results.get(seq - 1)
+        if prev is not None:
+            reason = implausible_jump(prev, res)
+            if reason is not None:
+                return self.__failure(seq, reason)
+
+        following = self.__results.get(seq + 1)
+        if following is not None:
+            reason = implausible_jump(res, following)
+            if reason is not None:
+                return self.__failure(seq + 1, reason)
+
+        return None
+
+    def __failure(self, seq: int, reason: str) -> Optional[Tuple[int, str]]:
+        # results arrive out of order, the cooldown holds on both sides of the last persisted failure
+        if self.__last is not None and abs(seq - self.__last) <= self.cooldown:
+            self.suppressed += 1
+            return None
+
+        self.__last = seq
+        return seq, reason
+
+    def frames(self, seq: int) -> list[Tuple[str, cv2.Mat]]:
+        # the failed frame and the ones read before it that no earlier failure has written
+        frames = [(key, name, frame) for key, name, frame in self.__frames if key <= seq][-self.size:]
+        unsaved = [(name, frame) for key, name, frame in frames if key not in self.__saved or key == seq]
+
+        self.__saved.update(key for key, _, _ in frames)
+        self.__saved = {key for key in self.__saved if key >= seq - self.__frames.maxlen}
+
+        return unsaved
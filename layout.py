@@ -0,0 +1,140 @@
+from typing import Callable, Optional, Tuple
+import cv2
+import numpy as np
+
+from utils import Rect
+
+class DigitLayout:
+    def __init__(self, index: int, rect: Rect, sliding: bool, max_width: int):
+        self.index = index
+        self.rect = rect
+        self.sliding = sliding
+        self.max_width = max_width
+
+class DisplayLayout:
+    def __init__(self, name: str, rect: Rect, digits: list[DigitLayout], fix_colon: bool, skip_detect: bool):
+        self.name = name
+        self.rect = rect
+        self.digits = digits
+        self.fix_colon = fix_colon
+        self.skip_detect = skip_detect
+
+    def guard(self) -> Optional[Rect]:
+        # strip left of the first digit, lit when a display gains a digit (e.g. temperature 99 -> 100)
+        if self.skip_detect or len(self.digits) == 0:
+            return None
+
+        first = self.digits[0].rect
+        return Rect([first.x - first.w, first.y, first.w, first.h])
+
+class PanelLayout:
+    def __init__(self, displays: dict[str, DisplayLayout], probes: dict[str, Rect]):
+        self.displays = displays
+        # areas of the sections that are only detected by being lit (MODE_*)
+        self.probes = probes
+
+    def is_similar(self, other, tolerance: float = 0.1) -> bool:
+        if other is None or self.displays.keys() != other.displays.keys():
+            return False
+
+        def __similar_rect(rect1: Rect, rect2: Rect) -> bool:
+            tol = max(2, int(tolerance * max(rect1.h, rect2.h)))
+            return all(abs(v1 - v2) <= tol for v1, v2 in zip(rect1.to_list(), rect2.to_list()))
+
+        for name, display in self.displays.items():
+            other_display = other.displays[name]
+            if len(display.digits) != len(other_display.digits) or \
+                not __similar_rect(display.rect, other_display.rect):
+                return False
+
+            for digit, other_digit in zip(display.digits, other_display.digits):
+                if not __similar_rect(digit.rect, other_digit.rect):
+                    return False
+
+        return True
+
+    def bounds(self) -> Rect:
+        rects = [display.rect for display in self.displays.values()] + list(self.probes.values())
+        rects += [guard for guard in (display.guard() for display in self.displays.values()) if guard is not None]
+
+        x = min(rect.x for rect in rects)
+        y = min(rect.y for rect in rects)
+        return Rect([x, y, max(rect.x2() for rect in rects) - x, max(rect.y2() for rect in rects) - y])
+
+    def is_valid(self, binary: Callable[[Rect], cv2.Mat], ratio: float = 0.05) -> bool:
+        def __lit(rect: Rect) -> bool:
+            roi = binary(rect)
+            return roi.size > 0 and np.count_nonzero(roi) > ratio * roi.size
+
+        for display in self.displays.values():
+            guard = display.guard()
+            if guard is not None and __lit(guard):
+                return False
+
+        for name, rect in self.probes.items():
+            if __lit(rect) != (name in self.displays):
+                return False
+
+        return True
+
+class LayoutCache:
+    def __init__(self, lock_frames: int = 3, revalidate: int = 60, change_ratio: float = 0.01):
+        self.lock_frames = lock_frames
+        self.revalidate = revalidate
+        # share of the binarized display pixels that may differ while the value is still the same
+        self.change_ratio = change_ratio
+
+        self.__candidate: Optional[PanelLayout] = None
+        self.__consistent = 0
+        self.__locked: Optional[PanelLayout] = None
+        self.__frames_since_lock = 0
+
+        # last binarized area and value read for each display of the locked layout
+        self.__values: dict[str, Tuple[cv2.Mat, str]] = {}
+
+    def get(self) -> Optional[PanelLayout]:
+        if self.__locked is None:
+            return None
+
+        # force a full detection now and then, update() keeps the lock when it still matches
+        if self.revalidate > 0 and self.__frames_since_lock >= self.revalidate:
+            return None
+
+        self.__frames_since_lock += 1
+        return self.__locked
+
+    def update(self, layout: PanelLayout):
+        if layout.is_similar(self.__candidate):
+            self.__consistent += 1
+        else:
+            self.__candidate = layout
+            self.__consistent = 1
+            self.__locked = None
+            self.__values.clear()
+
+        if self.__locked is None and self.__consistent >= self.lock_frames:
+            self.__locked = self.__candidate
+
+        self.__frames_since_lock = 0
+
+    def invalidate(self):
+        self.__candidate = None
+        self.__consistent = 0
+        self.__locked = None
+        self.__values.clear()
+
+    def unchanged_value(self, name: str, roi: cv2.Mat) -> Optional[str]:
+        # value of the display when its pixels match the last frame it was read on
+        if name not in self.__values:
+            return None
+
+        prev, value = self.__values[name]
+        if prev.shape != roi.shape or \
+            cv2.countNonZero(cv2.absdiff(prev, roi)) > self.change_ratio * roi.size:
+            return None
+
+        return value
+
+    def remember(self, name: str, roi: cv2.Mat, value: str):
+        # the roi is a view into the frame images, keep a copy
+        self.__values[name] = (roi.copy(), value)
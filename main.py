@@ -1,124 +1,392 @@
+import glob
 import os
 import shutil
+import sys
 import time
-from typing import List, Optional
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
+from itertools import chain, islice
+from typing import Iterator, Optional, Tuple
 import cv2
 import argparse
 import re
-import csv
 
+from artifacts import DEBUG_JPG, DEBUG_PNG, close_writer, get_writer
 from context import Context, FrameContext, Settings, Options
+from failures import FailureMonitor
+from output import FORMAT_STDOUT, SINKS, Result2, ResultWriter
+from panel import DEFAULT_PROFILE, load_profile
 from skywalker import SkyWalker, Result
+from temporal import AdaptiveStride, TemporalFilter
+from timing import TimingReport
+from utils import rotate_image
+from video import LiveCapture, live_frames, open_video, read_frames, video_duration
 
-class Result2:
-    def __init__(self, res: Result, elapsed: int):
-        self.result = res
-        self.elapsed = elapsed
+def process_image(ctx: FrameContext) -> Optional[Result]:
+    return SkyWalker(ctx).detect()
+
+def detect_frame(ctx: Context, name: str, frame: cv2.Mat, degree: Optional[int] = None, debug: Optional[bool] = None) -> Result2:
+    t1 = time.time()
+
+    image = rotate_image(frame, degree if degree is not None else ctx.rotation or 0)
+    frame_ctx = ctx.new_frame_context(name, image, debug)
+    with frame_ctx.timer.stage('frame'):
+        line = process_image(frame_ctx)
+
+    elapsed = int((time.time() - t1) * 1000)
+
+    # frames without a result keep their timings, the failing frames are often the slow ones
+    return Result2(line, elapsed, frame_ctx.timer.spans, os.getpid(), name)
+
+def _probe_score(ctx: Context, res: Optional[Result]) -> Tuple[int, int]:
+    # digit displays read, then located, a wrong rotation seldom lines up more than POWER and a lamp
+    if res is None:
+        return (0, 0)
+
+    located = [section.name for section in ctx.options.panel.sections.values()
+               if not section.skip_detect and section.name in res.displays]
+    return (len([name for name in located if name not in res.errors]), len(located))
+
+def probe_rotation(ctx: Context, name: str, frame: cv2.Mat, debug: Optional[bool] = None) -> Result2:
+    digits = len([section for section in ctx.options.panel.sections.values() if not section.skip_detect])
+    best: Optional[Result2] = None
+    best_degree = 0
+    spans = []
+    for degree in [0, 90, 180, 270]:
+        res = detect_frame(ctx, name, frame, degree, debug)
+        # the frame is timed with every rotation it was tried with
+        spans += res.spans
+
+        if best is None or _probe_score(ctx, res.result) > _probe_score(ctx, best.result):
+            best, best_degree = res, degree
+
+        # every digit display read, no other rotation can do better
+        if _probe_score(ctx, res.result)[0] == digits:
+            break
+
+    # most of the panel read is enough to lock the angle, a display that does not read (e.g. TEMPERATURE
+    # showing ---) must not have every later frame probe the 4 rotations again
+    if _probe_score(ctx, best.result)[0] * 2 > digits:
+        print(f'{name} detected rotation {best_degree}', file=sys.stderr)
+        ctx.save_rotation(best_degree)
+
+    best.spans = spans
+    return best
+
+_worker_context: Optional[Context] = None
+
+def _init_worker(ctx: Context):
+    global _worker_context
+    _worker_context = ctx
+
+def _detect_frame_worker(name: str, frame: cv2.Mat, debug: bool) -> Result2:
+    return detect_frame(_worker_context, name, frame, debug=debug)
+
+def detect_frames_probing(ctx: Context, frames: Iterator[Tuple[int, int, cv2.Mat]]) -> Iterator[Tuple[int, Result2]]:
+    # probe all rotations until a frame reads cleanly, the remaining frames reuse the winning angle
+    for seq, cur_sec, frame in frames:
+        yield seq, probe_rotation(ctx, f"frame_{cur_sec}", frame, ctx.sample_debug(seq))
+
+        if ctx.rotation is not None:
+            break
 
-def write_result(ctx: Context, results: list[Result2]):
-    if len(results) == 0:
+def detect_frames(ctx: Context, frames: Iterator[Tuple[int, int, cv2.Mat]]) -> Iterator[Tuple[int, Result2]]:
+    for seq, cur_sec, frame in frames:
+        yield seq, detect_frame(ctx, f"frame_{cur_sec}", frame, debug=ctx.sample_debug(seq))
+
+def detect_frames_parallel(ctx: Context, frames: Iterator[Tuple[int, int, cv2.Mat]], workers: int) -> Iterator[Tuple[int, Result2]]:
+    # bound the frames in flight and yield them as they complete, the writer restores the order
+    max_pending = workers * 2
+    pending: dict[Future, int] = {}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(ctx,)) as executor:
+        for seq, cur_sec, frame in frames:
+            pending[executor.submit(_detect_frame_worker, f"frame_{cur_sec}", frame, ctx.sample_debug(seq))] = seq
+
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+        for future, seq in pending.items():
+            yield seq, future.result()
+
+def report_timing(ctx: Context, report: Optional[TimingReport]):
+    if report is None:
         return
 
-    outFile = os.path.join(ctx.settings.output_path, 'results.csv')
-    with open(outFile, 'w') as f:
-        wrt = csv.writer(f, delimiter=',')
-        wrt.writerow(['name', 'time', 'temperature','profile', 'power',' fan', 'mode', 'elapsed (msec)'])
+    print(f'{ctx.settings.input_path} timing (msec)', file=sys.stderr)
+    report.print_summary(sys.stderr)
 
-        for res in results:
-            wrt.writerow([res.result.name, res.result.time, res.result.temperature, res.result.profile, res.result.power, res.result.fan, res.result.mode, res.elapsed])
+    if ctx.options.trace is not None:
+        report.write_trace(ctx.options.trace)
 
-def process_image(ctx: FrameContext) -> Optional[Result]:
-    degrees: List[int] = [0]
-    options: Options = ctx.options
+def report_failures(monitor: Optional[FailureMonitor]):
+    if monitor is not None and monitor.suppressed > 0:
+        print(f'{monitor.suppressed} failures within {monitor.cooldown} frames of a written one were not written', file=sys.stderr)
+
+def persist_failure(ctx: Context, monitor: FailureMonitor, seq: int, reason: str):
+    frames = monitor.frames(seq)
+    if len(frames) == 0:
+        return
 
-    if options.rotate:
-        if options.rotate.isdigit():
-            degrees = [int(options.rotate)]
-        elif options.rotate == 'auto':
-            degrees = [0, 90, 180, 270]
-        
-    for degree in degrees:
-        image = ctx.image
-        if degree == 90:
-            image = cv2.transpose(image, degree)
-            image = cv2.flip(image, 1)
-        elif degree == 180:
-            image = cv2.flip(image, -1)
-        elif degree == 270:
-            image = cv2.transpose(image, degree)
-            image = cv2.flip(image, 0)
-
-        res = SkyWalker(ctx).detect()
-        if res is not None:
-            return res
-            
-    return None
+    name, frame = frames[-1]
+    failures_path = os.path.join(ctx.settings.output_path, '_failures')
+    path = os.path.join(failures_path, name)
+    print(f'{name} failed ({reason}), writing {path}', file=sys.stderr)
+
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'reason.txt'), 'w') as f:
+        f.write(reason + '\n')
+
+    writer = get_writer(ctx.options.debug_format)
+    for i, (frame_name, frame_image) in enumerate(frames):
+        writer.write(os.path.join(path, f'ring-{i}-{frame_name}'), frame_image)
+
+    # read the failed frame again from scratch with every debug step
+    image = rotate_image(frame, ctx.rotation or 0)
+    SkyWalker(ctx.new_frame_context(name, image, debug=True, debug_path=failures_path, use_layout=False)).detect()
+
+def record_line(ctx: Context, seq: int, line: Result2, 
+                writer: ResultWriter, report: Optional[TimingReport], monitor: Optional[FailureMonitor]):
+    if report is not None:
+        report.add(line.name, line.spans, line.pid)
+
+    # checked before the writer's temporal filter corrects the result
+    if monitor is not None:
+        failure = monitor.check(seq, line.result)
+        if failure is not None:
+            persist_failure(ctx, monitor, *failure)
+
+    writer.write(seq, line if line.result is not None else None)
 
 def process_video(ctx: Context):
     settings: Settings = ctx.settings
     options: Options = ctx.options
 
-    video = cv2.VideoCapture(settings.input_path)
-    if not video.isOpened():
-        raise ValueError(f"Cannot open video file: {settings.input_path}")
-    
-    cur_sec = options.skip
-    num_frames = options.count
+    if options.resume:
+        last = ResultWriter.last_timestamp(settings.output_path, options.output)
+        if last is not None:
+            print(f'resuming after frame_{last}', file=sys.stderr)
+            options.skip = last + options.interval
 
-    results: list[Result] = []
+    stride = AdaptiveStride(options.interval, options.max_interval) if options.max_interval > options.interval else None
+    temporal = TemporalFilter(options.temporal, stride=stride) if options.temporal or stride is not None else None
 
-    while True:
-        video.set(cv2.CAP_PROP_POS_MSEC, cur_sec * 1000)
-        ret, frame = video.read()
+    writer = ResultWriter(settings.output_path, options.output, append=options.resume, batch_size=options.batch_size,
+                          transform=temporal.apply if temporal is not None else None)
+    video = open_video(settings.input_path)
 
-        if not ret:
-            break
-        
-        t1 = time.time()
-        line = process_image(ctx.new_frame_context(f"frame_{cur_sec}", frame))
+    report = TimingReport() if options.profile else None
+
+    frames = read_frames(video, options, stride)
+    if report is not None:
+        frames = report.timed(frames, 'decode')
+    if options.count > 0:
+        frames = islice(frames, options.count)
+    frames = ((seq, cur_sec, frame) for seq, (cur_sec, frame) in enumerate(frames))
+
+    monitor = FailureMonitor(options.debug_on_failure, options.workers) if options.debug_on_failure > 0 else None
+    if monitor is not None:
+        frames = monitor.track(frames)
 
-        elapsed = int((time.time() - t1) * 1000)
+    try:
+        lines = detect_frames_probing(ctx, frames) if ctx.rotation is None else iter(())
+        if options.workers > 1:
+            lines = chain(lines, detect_frames_parallel(ctx, frames, options.workers))
+        else:
+            lines = chain(lines, detect_frames(ctx, frames))
 
-        if line is not None:
-            results.append(Result2(line, elapsed))
+        for seq, line in lines:
+            record_line(ctx, seq, line, writer, report, monitor)
+    finally:
+        writer.close()
+        video.release()
+        close_writer()
 
-        if options.count > 0:
-            num_frames = num_frames - 1
-            if num_frames == 0:
-                break
+    report_timing(ctx, report)
+    report_failures(monitor)
 
-        cur_sec += options.interval
+def process_live(ctx: Context):
+    settings: Settings = ctx.settings
+    options: Options = ctx.options
+    latency = options.latency / 1000
+
+    # every result is emitted as soon as it is read
+    formats = options.output if FORMAT_STDOUT in options.output else options.output + [FORMAT_STDOUT]
+    temporal = TemporalFilter() if options.temporal else None
+    writer = ResultWriter(settings.output_path, formats, append=options.resume, batch_size=1,
+                          transform=temporal.apply if temporal is not None else None)
+    capture = LiveCapture(settings.input_path, options.buffer_size, options.loop)
+
+    report = TimingReport() if options.profile else None
+
+    frames = live_frames(capture, options.interval, latency)
+    if options.count > 0:
+        frames = islice(frames, options.count)
+    frames = ((seq, cur_sec, frame) for seq, (cur_sec, frame) in enumerate(frames))
+
+    monitor = FailureMonitor(options.debug_on_failure) if options.debug_on_failure > 0 else None
+    if monitor is not None:
+        frames = monitor.track(frames)
+
+    try:
+        # frames are processed one at a time as they arrive, the newest frame always wins
+        lines = detect_frames_probing(ctx, frames) if ctx.rotation is None else iter(())
+        for seq, line in chain(lines, detect_frames(ctx, frames)):
+            record_line(ctx, seq, line, writer, report, monitor)
+
+            if line.elapsed > options.latency:
+                print(f'{line.name} took {line.elapsed} msec, over the {options.latency} msec budget (dropped {capture.dropped} frames)', file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        capture.release()
+        close_writer()
+
+    report_timing(ctx, report)
+    report_failures(monitor)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.m4v')
+
+# written into a video's output directory once it has been read to the end
+COMPLETE_MARKER = '.complete'
+
+def find_videos(input_path: str) -> list[str]:
+    if os.path.isdir(input_path):
+        paths = [os.path.join(input_path, name) for name in os.listdir(input_path)]
+    else:
+        paths = glob.glob(input_path)
+
+    return sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS))
+
+def is_up_to_date(video_path: str, output_path: str) -> bool:
+    marker = os.path.join(output_path, COMPLETE_MARKER)
+    return os.path.exists(marker) and os.path.getmtime(marker) >= os.path.getmtime(video_path)
+
+def process_batch_video(args: argparse.Namespace, video_path: str, output_path: str):
+    video_args = argparse.Namespace(**vars(args))
+    video_args.input_path = video_path
+    video_args.output_path = output_path
+    if args.trace is not None:
+        video_args.trace = os.path.join(output_path, os.path.basename(args.trace))
+
+    if not args.resume:
+        shutil.rmtree(output_path, ignore_errors=True)
+    os.makedirs(output_path, exist_ok=True)
+
+    process_video(Context(video_args))
+
+    with open(os.path.join(output_path, COMPLETE_MARKER), 'w'):
+        pass
 
-    video.release()
+def process_batch(args: argparse.Namespace):
+    jobs: list[Tuple[str, str]] = []
+    for video_path in find_videos(args.input_path):
+        output_path = os.path.join(args.output_path, os.path.splitext(os.path.basename(video_path))[0])
+        if is_up_to_date(video_path, output_path):
+            print(f'{video_path} is up to date', file=sys.stderr)
+            continue
 
-    write_result(ctx, results)
+        jobs.append((video_path, output_path))
+
+    if len(jobs) == 0:
+        return
+
+    # longest videos first so a long roast does not start last and hold up the whole batch
+    jobs.sort(key=lambda job: video_duration(job[0]), reverse=True)
+
+    # videos running side by side already keep the cores busy, a detection pool per video would start jobs x workers processes
+    processes = min(args.jobs, len(jobs))
+    if processes > 1 and args.workers > 1:
+        print(f'{processes} videos at once, detecting every video in its own process (--workers ignored)', file=sys.stderr)
+        args = argparse.Namespace(**vars(args))
+        args.workers = 1
+
+    os.makedirs(args.output_path, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(process_batch_video, args, video_path, output_path): video_path for video_path, output_path in jobs}
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+                print(f'{futures[future]} done', file=sys.stderr)
+            except Exception as e:
+                print(f'{futures[future]} failed: {e}', file=sys.stderr)
 
 def main(args):
+    unknown = [fmt for fmt in args.output if fmt not in SINKS]
+    if len(unknown) > 0:
+        print(f"Unknown output: {','.join(unknown)}", file=sys.stderr)
+        return
+
+    try:
+        load_profile(args.panel)
+    except (OSError, ValueError) as e:
+        print(f"Invalid panel profile {args.panel}: {e}", file=sys.stderr)
+        return
+
     input_path = args.input_path
     output_path = args.output_path
 
+    if args.live:
+        os.makedirs(output_path, exist_ok=True)
+        process_live(Context(args))
+        return
+
+    if os.path.isdir(input_path) or any(c in input_path for c in '*?['):
+        process_batch(args)
+        return
+
     if not os.path.exists(input_path):
-        print(f"Input path does not exist: {input_path}")
+        print(f"Input path does not exist: {input_path}", file=sys.stderr)
         return
 
-    shutil.rmtree(output_path, ignore_errors=True)
+    if not args.resume:
+        shutil.rmtree(output_path, ignore_errors=True)
     os.makedirs(output_path, exist_ok=True)
 
     if not os.path.isfile(input_path):
-        print(f"input file not found: {input_path}")
+        print(f"input file not found: {input_path}", file=sys.stderr)
         return
 
     context = Context(args)
     process_video(context)
 
-if __name__ == "__main__":
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Process images from input path and save to output path.")
-    parser.add_argument('input_path', type=str, help="Path to the input images directory or video file.")
+    parser.add_argument('input_path', type=str, help="Path to the input video file, or a directory or glob of videos.")
     parser.add_argument('output_path', type=str, help="Path to the output (and debug) directory.")
     parser.add_argument('--skip', type=int, default=0, required=False, help="Skip number of seconds.")
     parser.add_argument('--count', type=int, default=0, required=False, help="Number of frames to process.")
     parser.add_argument('--interval', type=int, default=30, required=False, help="Processing Interval.")
+    parser.add_argument('--max-interval', type=int, default=0, required=False, help="Grow the interval up to this many seconds while the displays do not change.")
+    parser.add_argument('--temporal', action='store_true', help="Correct misread values from the previous frames (monotonic time, plausible temperature jumps).")
+    parser.add_argument('--decode', type=str, default='auto', choices=['auto', 'seek', 'sequential'], required=False, help="Frame decoding strategy (auto|seek|sequential).")
+    parser.add_argument('--layout-lock', type=int, default=3, required=False, help="Reuse the display layout after N consistent frames (0 to disable).")
+    parser.add_argument('--layout-revalidate', type=int, default=60, required=False, help="Re-detect the cached display layout every N frames (0 to disable).")
+    parser.add_argument('--workers', type=int, default=1, required=False, help="Number of detection processes.")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, required=False, help="Number of videos processed at once in batch mode.")
     parser.add_argument('--rotate', type=str, default='auto', required=False, help="Rotation (auto|<degree>).")
+    parser.add_argument('--live', action='store_true', help="Read from a capture device index or stream URL instead of a video file.")
+    parser.add_argument('--loop', action='store_true', help="Loop the live source, a video file standing in for a camera.")
+    parser.add_argument('--latency', type=int, default=1000, required=False, help="Live mode latency budget in milliseconds.")
+    parser.add_argument('--buffer-size', type=int, default=2, required=False, help="Live mode frame ring buffer size.")
+    parser.add_argument('--output', type=lambda s: s.split(','), default=['csv'], required=False, help=f"Comma separated result outputs ({'|'.join(SINKS)}).")
+    parser.add_argument('--batch-size', type=int, default=64, required=False, help="Number of results written to the outputs at once.")
+    parser.add_argument('--resume', action='store_true', help="Append to an existing results.csv, continuing after its last frame.")
+    parser.add_argument('--profile', action='store_true', help="Print per-stage timing percentiles at the end of the run.")
+    parser.add_argument('--trace', type=str, default=None, required=False, help="Write per-stage timings as a Chrome trace JSON to this path (implies --profile).")
     parser.add_argument('--debug', type=bool, default=False, required=False, help="Write debug image")
-    
-    main(parser.parse_args())
+    parser.add_argument('--debug-on-failure', type=int, default=0, required=False, help="Keep the last N frames and write them with the debug steps of frames that fail to read (0 to disable).")
+    parser.add_argument('--debug-every', type=int, default=1, required=False, help="Only write debug images of every Nth frame.")
+    parser.add_argument('--debug-format', type=str, default=DEBUG_PNG, choices=[DEBUG_PNG, DEBUG_JPG], required=False, help="Debug image format (png|jpg).")
+    parser.add_argument('--coarse-scale', type=float, default=0, required=False, help="Locate the panel on a frame downscaled by this factor first, e.g. 0.25 for 4K (0 to disable).")
+    parser.add_argument('--panel', type=str, default=DEFAULT_PROFILE, required=False, help="Panel profile JSON (section geometry, glyphs, thresholds).")
+    parser.add_argument('--aoi-extract', type=str, default='contours', choices=['contours', 'components'], required=False, help="Display candidate extraction (contours|components).")
+    parser.add_argument('--ssd-engine', type=str, default='contour', choices=['contour', 'mask'], required=False, help="Seven segment classifier (contour|mask).")
+
+    return parser
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
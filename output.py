@@ -0,0 +1,260 @@
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from typing import Callable, Optional
+
+from skywalker import Result
+from timing import Span
+from utils import frame_seconds
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMAT_PARQUET = 'parquet'
+FORMAT_STDOUT = 'stdout'
+
+FIELDS = ['name', 'time', 'temperature', 'profile', 'power', 'fan', 'mode', 'elapsed']
+
+class Result2:
+    def __init__(self, res: Optional[Result], elapsed: int, spans: Optional[list[Span]] = None, pid: int = 0, name: Optional[str] = None):
+        # None when the displays were not found
+        self.result = res
+        self.name = name if name is not None else res.name
+        self.elapsed = elapsed
+        # per-stage timings of the frame and the process it ran in (with --profile)
+        self.spans = spans if spans is not None else []
+        self.pid = pid
+
+    def to_row(self) -> list:
+        res = self.result
+        return [res.name, res.time, res.temperature, res.profile, res.power, res.fan, res.mode, self.elapsed]
+
+class Sink:
+    def write(self, rows: list[list]):
+        pass
+
+    def flush(self, sync: bool):
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def last_timestamp(output_path: str) -> Optional[int]:
+        return None
+
+class CsvSink(Sink):
+    header = ['name', 'time', 'temperature', 'profile', 'power', 'fan', 'mode', 'elapsed (msec)']
+
+    def __init__(self, output_path: str, append: bool = False):
+        path = os.path.join(output_path, 'results.csv')
+        write_header = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+
+        self.__file = open(path, 'a' if append else 'w', newline='')
+        self.__writer = csv.writer(self.__file, delimiter=',')
+        if write_header:
+            self.__writer.writerow(CsvSink.header)
+
+    def write(self, rows: list[list]):
+        self.__writer.writerows(rows)
+
+    def flush(self, sync: bool):
+        self.__file.flush()
+        if sync:
+            os.fsync(self.__file.fileno())
+
+    def close(self):
+        self.__file.close()
+
+    @staticmethod
+    def last_timestamp(output_path: str) -> Optional[int]:
+        path = os.path.join(output_path, 'results.csv')
+        if not os.path.exists(path):
+            return None
+
+        last = None
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                sec = frame_seconds(row[0]) if len(row) > 0 else None
+                if sec is not None:
+                    last = sec
+
+        return last
+
+class JsonLinesSink(Sink):
+    def __init__(self, output_path: str, append: bool = False):
+        self.__file = open(os.path.join(output_path, 'results.jsonl'), 'a' if append else 'w')
+
+    def write(self, rows: list[list]):
+        self.__file.write(''.join(json.dumps(dict(zip(FIELDS, row))) + '\n' for row in rows))
+
+    def flush(self, sync: bool):
+        self.__file.flush()
+        if sync:
+            os.fsync(self.__file.fileno())
+
+    def close(self):
+        self.__file.close()
+
+    @staticmethod
+    def last_timestamp(output_path: str) -> Optional[int]:
+        path = os.path.join(output_path, 'results.jsonl')
+        if not os.path.exists(path):
+            return None
+
+        last = None
+        with open(path) as f:
+            for line in f:
+                try:
+                    sec = frame_seconds(json.loads(line)['name'])
+                except (ValueError, KeyError):
+                    # a line cut short by a killed run
+                    continue
+
+                if sec is not None:
+                    last = sec
+
+        return last
+
+class ParquetSink(Sink):
+    def __init__(self, output_path: str, append: bool = False):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("The parquet output requires pyarrow (pip install pyarrow)")
+
+        self.__pa = pyarrow
+        self.__schema = pyarrow.schema([
+            ('name', pyarrow.string()),
+            ('time', pyarrow.int32()),
+            ('temperature', pyarrow.int32()),
+            ('profile', pyarrow.string()),
+            ('power', pyarrow.int32()),
+            ('fan', pyarrow.int32()),
+            ('mode', pyarrow.string()),
+            ('elapsed', pyarrow.int32()),
+        ])
+
+        # a parquet file cannot be appended to, a resumed run writes the next part
+        path = os.path.join(output_path, 'results.parquet')
+        part = 0
+        while append and os.path.exists(path):
+            part += 1
+            path = os.path.join(output_path, f'results.{part}.parquet')
+
+        self.__writer = pyarrow.parquet.ParquetWriter(path, self.__schema)
+
+    def write(self, rows: list[list]):
+        # every batch becomes one row group
+        columns = list(zip(*rows))
+        self.__writer.write_table(self.__pa.Table.from_arrays(
+            [self.__pa.array(column, type=field.type) for column, field in zip(columns, self.__schema)],
+            schema=self.__schema))
+
+    def close(self):
+        self.__writer.close()
+
+    @staticmethod
+    def last_timestamp(output_path: str) -> Optional[int]:
+        paths = glob.glob(os.path.join(output_path, 'results*.parquet'))
+        if len(paths) == 0:
+            return None
+
+        import pyarrow
+        import pyarrow.parquet
+
+        names = []
+        for path in paths:
+            try:
+                names += pyarrow.parquet.read_table(path, columns=['name'])['name'].to_pylist()
+            except (pyarrow.ArrowInvalid, OSError) as e:
+                # a part left without its footer by a killed run
+                print(f'skipping {path}: {e}', file=sys.stderr)
+
+        secs = [sec for sec in (frame_seconds(name) for name in names) if sec is not None]
+        return max(secs) if len(secs) > 0 else None
+
+class StdoutSink(Sink):
+    def __init__(self, output_path: str, append: bool = False):
+        pass
+
+    def write(self, rows: list[list]):
+        sys.stdout.write(''.join(','.join(str(v) for v in row) + '\n' for row in rows))
+
+    def flush(self, sync: bool):
+        sys.stdout.flush()
+
+SINKS: dict[str, type[Sink]] = {
+    FORMAT_CSV: CsvSink,
+    FORMAT_JSONL: JsonLinesSink,
+    FORMAT_PARQUET: ParquetSink,
+    FORMAT_STDOUT: StdoutSink,
+}
+
+class ResultWriter:
+    def __init__(self, output_path: str, formats: Optional[list[str]] = None, append: bool = False,
+                 batch_size: int = 64, fsync_seconds: float = 5.0,
+                 transform: Optional[Callable[[Optional[Result2]], Optional[Result2]]] = None):
+        self.sinks = [SINKS[fmt](output_path, append) for fmt in (formats if formats is not None else [FORMAT_CSV])]
+        # applied to the results in frame order before they are written (e.g. a temporal filter)
+        self.transform = transform
+        self.batch_size = batch_size
+        self.fsync_seconds = fsync_seconds
+
+        # frames can complete out of order, rows wait here until every earlier frame is done
+        self.__pending: dict[int, Optional[Result2]] = {}
+        self.__next = 0
+
+        self.__batch: list[list] = []
+        self.__last_sync = time.time()
+
+    def write(self, seq: int, res: Optional[Result2]):
+        self.__pending[seq] = res
+
+        while self.__next in self.__pending:
+            res = self.__pending.pop(self.__next)
+            self.__next += 1
+
+            if self.transform is not None:
+                res = self.transform(res)
+
+            if res is not None:
+                self.__batch.append(res.to_row())
+
+        if len(self.__batch) >= self.batch_size or \
+            (len(self.__batch) > 0 and time.time() - self.__last_sync >= self.fsync_seconds):
+            self.__flush()
+
+    def __flush(self):
+        if len(self.__batch) > 0:
+            for sink in self.sinks:
+                sink.write(self.__batch)
+            self.__batch = []
+
+        for sink in self.sinks:
+            sink.flush(sync=True)
+        self.__last_sync = time.time()
+
+    def close(self):
+        # rows still waiting for an earlier frame are written as they are
+        while self.__pending:
+            seq = min(self.__pending)
+            self.__next = seq
+            self.write(seq, self.__pending.pop(seq))
+
+        self.__flush()
+        for sink in self.sinks:
+            sink.close()
+
+    @staticmethod
+    def last_timestamp(output_path: str, formats: list[str]) -> Optional[int]:
+        # second of the last frame written by a previous run, from its 'frame_<sec>' name
+        for fmt in formats:
+            last = SINKS[fmt].last_timestamp(output_path)
+            if last is not None:
+                return last
+
+        return None
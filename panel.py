@@ -0,0 +1,101 @@
+import json
+import math
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# segment order follows the SSD zones: top, top-right, bottom-right, bottom, bottom-left, top-left, middle
+SEGMENTS = 7
+BLANK = '0' * SEGMENTS
+
+DEFAULT_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles', 'skywalker.json')
+
+class Section:
+    def __init__(self, name: str, angle: float, length: float, skip_detect: bool = False, digits: int = 0, colon: bool = False):
+        self.name = name
+        # direction and distance (in POWER display heights) from the POWER display
+        self.angle = angle
+        self.length = length
+        # sections only detected by being lit (MODE_*)
+        self.skip_detect = skip_detect
+        # most digits the display shows, 0 when unknown
+        self.digits = digits
+        # a clock display, the colon dots merge with the digits next to them
+        self.colon = colon
+
+        # offset per unit of POWER display height, so projecting a section is a multiply and an add
+        self.direction = (length * math.cos(math.radians(angle)), length * math.sin(math.radians(angle)))
+
+    def to_dict(self) -> dict:
+        section = {'name': self.name, 'angle': self.angle, 'length': self.length}
+        if self.digits > 0:
+            section['digits'] = self.digits
+        if self.colon:
+            section['colon'] = True
+        if self.skip_detect:
+            section['skip_detect'] = True
+        return section
+
+class PanelProfile:
+    def __init__(self, name: str, sections: list[Section], glyphs: dict[str, str],
+                 threshold: int = 200, dilate_kernel: int = 10, digit_kernel: int = 5,
+                 min_area: int = 100, x_threshold: int = 100):
+        self.name = name
+        self.sections: dict[str, Section] = {section.name: section for section in sections}
+        self.glyphs = glyphs
+        # binarization level of the lit segments, and the kernels that merge segments into digits and digits into displays
+        self.threshold = threshold
+        self.dilate_kernel = dilate_kernel
+        self.digit_kernel = digit_kernel
+        self.min_area = min_area
+        self.x_threshold = x_threshold
+
+        if 'POWER' not in self.sections:
+            raise ValueError(f'panel profile {name} has no POWER section')
+
+        # segment pattern to character, an unlit digit reads as nothing
+        self.patterns: dict[str, Optional[str]] = {BLANK: None}
+        for char, segments in glyphs.items():
+            if len(segments) != SEGMENTS or set(segments) - {'0', '1'}:
+                raise ValueError(f'panel profile {name} glyph {char} has invalid segments {segments}')
+            if segments in self.patterns:
+                raise ValueError(f'panel profile {name} glyph {char} has the segments of {self.patterns[segments]}')
+            self.patterns[segments] = char
+
+    def project(self, section: Section, origin: Tuple[int, int], height: int) -> Tuple[int, int]:
+        # where section is expected, from the projected center and height of the POWER display
+        return (int(origin[0] + height * section.direction[0]), int(origin[1] + height * section.direction[1]))
+
+    @classmethod
+    def from_dict(cls, profile: dict):
+        try:
+            sections = [Section(s['name'], float(s['angle']), float(s['length']), s.get('skip_detect', False),
+                                int(s.get('digits', 0)), s.get('colon', False))
+                        for s in profile['sections']]
+            return cls(profile.get('name', ''), sections, profile['glyphs'],
+                       int(profile.get('threshold', 200)), int(profile.get('dilate_kernel', 10)), int(profile.get('digit_kernel', 5)),
+                       int(profile.get('min_area', 100)), int(profile.get('x_threshold', 100)))
+        except (KeyError, TypeError) as e:
+            raise ValueError(f'invalid panel profile: missing or invalid {e}')
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'threshold': self.threshold,
+            'dilate_kernel': self.dilate_kernel,
+            'digit_kernel': self.digit_kernel,
+            'min_area': self.min_area,
+            'x_threshold': self.x_threshold,
+            'sections': [section.to_dict() for section in self.sections.values()],
+            'glyphs': self.glyphs,
+        }
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+@lru_cache(maxsize=None)
+def load_profile(path: str = DEFAULT_PROFILE) -> PanelProfile:
+    # parsed once per process, workers get the compiled profile with the options
+    with open(path) as f:
+        return PanelProfile.from_dict(json.load(f))
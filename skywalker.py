@@ -1,18 +1,19 @@
 
+import sys
 from typing import Optional
 import cv2
-from aoi import find_aoi
-from context import FrameContext
+import numpy as np
+from aoi import extract_boxes, find_aoi
+from context import FrameContext, FrameImages
 from debug import _debug, _debug_displays, _debug_projection
 from display import Digit, Display
-from utils import calculate_projection, find_central_box_index, find_projection_rect_index
+from ssd import SSD, DigitCrop
+from layout import DigitLayout, DisplayLayout, LayoutCache, PanelLayout
+from panel import PanelProfile
+from utils import Rect, RectSet, find_central_box_index, find_projection_rect_index
 
-class Section:
-    def __init__(self, name: str, angle: float, length: float, skip_detect: bool = False):
-        self.name = name
-        self.angle = angle
-        self.length = length
-        self.skip_detect = skip_detect
+# above this many lit clusters on the coarse frame (glare specks), one full resolution pass is cheaper than a pass per region
+COARSE_MAX_CLUSTERS = 32
 
 class Result:
     def __init__(self, name: str):
@@ -23,59 +24,94 @@ class Result:
         self.fan = 0
         self.time = 0
         self.mode = ""
+        # names of the displays located on the panel
+        self.displays: list[str] = []
+        # error messages by the name of the display that failed to read
+        self.errors: dict[str, list[str]] = {}
+
+    def is_valid(self) -> bool:
+        return len(self.errors) == 0
+
+    def fail(self, display: str, error: str):
+        self.errors.setdefault(display, []).append(error)
+
+    def error_messages(self) -> list[str]:
+        return [f'{display} {error}' for display, errors in self.errors.items() for error in errors]
         
 class SkyWalker():
     def __init__(self, ctx: FrameContext):
         self.ctx = ctx
 
-        self.__init_sections()
-        self.minAreaSize = 50
-
-    def __init_sections(self):
-        self.__sections = {
-            "TEMPERATURE": Section("TEMPERATURE", -149.85, 4.91),
-            "PROFILE": Section("PROFILE", -51.16, 2.92),
-            "POWER": Section("POWER", 0, 0),
-            "FAN": Section("FAN", 0.0, 4.67),
-            "TIME": Section("TIME", 165.21, 4.48),
-            "MODE_PREHEAT": Section("MODE_PREHEAT", 113.12, 4.24, True),
-            "MODE_ROAST": Section("MODE_ROAST", 84.61, 4.08, True),
-            "MODE_COOL": Section("MODE_COOL", 54.85, 4.77, True),
-        }
+        # section geometry, glyphs and thresholds of the roaster, compiled when the options are loaded
+        self.panel: PanelProfile = ctx.options.panel
+        self.__probes: dict[str, Rect] = {}
 
     def __preprocess_image(self) -> cv2.Mat:
-        ctx = self.ctx
-        gray_image = cv2.cvtColor(ctx.image, cv2.COLOR_BGR2GRAY)
+        return self.ctx.images.dilate(self.panel.dilate_kernel)
+
+    def __locate_panel(self, scale: float) -> Optional[list[Rect]]:
+        # coarse pass on a downscaled frame, the full resolution passes only run inside the lit clusters it finds
+        image = self.ctx.image
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+        small = cv2.threshold(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), self.panel.threshold, 255, cv2.THRESH_BINARY)[1]
+        small = cv2.dilate(small, FrameImages.kernel(max(1, round(self.panel.dilate_kernel * scale))), iterations=1)
+
+        rects = extract_boxes(small, self.panel.min_area * scale * scale, method=self.ctx.options.aoi_extract)
+        if len(rects) > COARSE_MAX_CLUSTERS:
+            _debug(self.ctx, lambda: print(f'{self.ctx.name} {len(rects)} coarse clusters, reading the full frame', file=sys.stderr))
+            return None
+
+        # grow every cluster by its height, Digit.fix_size widens a narrow '1' to the left by up to a digit width,
+        # plus the full resolution dilation and a coarse pixel of rounding
+        margin = (rects.h / scale).astype(np.int32) + self.panel.dilate_kernel + int(1 / scale) + 1
+        x = np.maximum((rects.x / scale).astype(np.int32) - margin, 0)
+        y = np.maximum((rects.y / scale).astype(np.int32) - margin, 0)
+        x2 = np.minimum((rects.x2() / scale).astype(np.int32) + margin, image.shape[1])
+        y2 = np.minimum((rects.y2() / scale).astype(np.int32) + margin, image.shape[0])
 
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (10, 10)) 
-        dilated_image = cv2.dilate(gray_image, kernel, iterations=1)
+        # merge the clusters whose grown regions overlap, so a blob is never split between two regions
+        return RectSet(np.stack([x, y, x2 - x, y2 - y], axis=1)).merged().rects()
 
-        _, threshold_image = cv2.threshold(dilated_image, 200, 255, cv2.THRESH_BINARY) 
+    def __find_aois(self, regions: Optional[list[Rect]]) -> list:
+        aois = []
+        for region in regions if regions is not None else [None]:
+            if region is not None:
+                self.ctx.images.restrict(region)
 
-        return threshold_image
+            with self.ctx.timer.stage('preprocess'):
+                processed_image = self.__preprocess_image()
 
-    def __detect_displays(self, threshold_image) -> list[Display]:
-        aois = find_aoi(self.ctx, threshold_image, 100)
+            offset = (region.x, region.y) if region is not None else (0, 0)
+            with self.ctx.timer.stage('find_aoi'):
+                aois += find_aoi(self.ctx, processed_image, self.panel.min_area, self.panel.x_threshold, offset, self.ctx.options.aoi_extract)
 
+        return aois
+
+    def __detect_displays(self, aois: list) -> list[Display]:
         if not aois or len(aois) == 0:
             return None
 
         displays: dict[str, Display]= {}
 
-        cidx = find_central_box_index([aoi.rect for aoi in aois])
+        rects = RectSet.from_rects([aoi.rect for aoi in aois])
+
+        cidx = find_central_box_index(rects)
         aoi = aois[cidx]
 
         displays['POWER'] = Display(self.ctx, 'POWER', aoi.rect, [Digit(self.ctx, 'POWER', i, rect) for i, rect in enumerate(aoi.items)])
         
-        rects = [aoi.rect for aoi in aois]
-        
-        _debug(self.ctx, lambda: _debug_projection(self.ctx, rects))
+        _debug(self.ctx, lambda: _debug_projection(self.ctx, rects.rects()))
 
-        for section in self.__sections.values():
+        origin = aoi.rect.projected().center()
+        for section in self.panel.sections.values():
             if section.name == 'POWER':
                 continue
 
-            pt_check = calculate_projection(aoi.rect.projected(), section.length, section.angle)
+            pt_check = self.panel.project(section, origin, aoi.rect.h)
+            if section.skip_detect:
+                h = aoi.rect.h
+                self.__probes[section.name] = Rect([pt_check[0] - h // 2, pt_check[1] - h // 2, h, h])
+
             idx2 = find_projection_rect_index(pt_check, rects)
 
             if idx2 is None:
@@ -85,8 +121,7 @@ class SkyWalker():
 
             display = Display(self.ctx, section.name, aoi2.rect, [Digit(self.ctx, section.name, i, rect) 
                                                                   for i, rect in enumerate(aoi2.items)])
-            if section.name == "TIME":
-                display.fix_colon = True
+            display.fix_colon = section.colon
 
             display.skip_detect = section.skip_detect
 
@@ -103,11 +138,86 @@ class SkyWalker():
             digit_height = max(digit_height, display_digit_height) 
             digit_width = max(digit_width, display_digit_width) 
 
-        for display in displays.values():
-            display.fix_digits_size(digit_width, digit_height)
+        with self.ctx.timer.stage('fix_digits_size'):
+            for display in displays.values():
+                display.fix_digits_size(digit_width, digit_height)
+
+        return displays
+
+    def __snapshot_layout(self, displays: dict[str, Display]) -> PanelLayout:
+        return PanelLayout({name: DisplayLayout(name, display.rect, 
+                                                [DigitLayout(d.index, d.rect, d.sliding, d.max_width) for d in display.digits],
+                                                display.fix_colon, display.skip_detect)
+                            for name, display in displays.items()},
+                           self.__probes)
+
+    def __restore_displays(self, layout: PanelLayout) -> dict[str, Display]:
+        displays: dict[str, Display] = {}
+        for name, display_layout in layout.displays.items():
+            digits: list[Digit] = []
+            for digit_layout in display_layout.digits:
+                digit = Digit(self.ctx, name, digit_layout.index, digit_layout.rect)
+                digit.sliding = digit_layout.sliding
+                digit.max_width = digit_layout.max_width
+                digits.append(digit)
+
+            display = Display(self.ctx, name, display_layout.rect, digits)
+            display.fix_colon = display_layout.fix_colon
+            display.skip_detect = display_layout.skip_detect
+            displays[name] = display
 
         return displays
 
+    def __detect_values(self, displays: dict[str, Display], cache: Optional[LayoutCache] = None) -> dict[str, str]:
+        # with a locked layout, displays whose pixels did not change since the last frame keep their value
+        rois: dict[str, cv2.Mat] = {}
+        unchanged: dict[str, str] = {}
+        if cache is not None:
+            for display in displays.values():
+                if display.skip_detect:
+                    continue
+
+                rois[display.name] = self.ctx.images.binary(display.rect)
+                value = cache.unchanged_value(display.name, rois[display.name])
+                if value is not None:
+                    unchanged[display.name] = value
+
+        # gather the digits of every display, preprocess and classify them as one batch,
+        # sliding digits run their own offset search, empty digits (outside the frame) read as unrecognized
+        digits: list[Digit] = [digit for display in displays.values() 
+                               if not display.skip_detect and display.name not in unchanged
+                               for digit in display.digits 
+                               if not digit.sliding and digit.binary().size > 0]
+
+        with self.ctx.timer.stage('ssd'):
+            processed = SSD().preprocess_batch([digit.binary() for digit in digits], self.panel.threshold, self.panel.digit_kernel)
+            crops = [DigitCrop(digit.name, digit.index, digit.image(), image) for digit, image in zip(digits, processed)]
+            chars = dict(zip(digits, SSD().classify_batch(self.ctx, crops)))
+
+        values: dict[str, str] = {}
+        for display in displays.values():
+            if display.skip_detect:
+                continue
+
+            if display.name in unchanged:
+                values[display.name] = unchanged[display.name]
+                continue
+
+            value = ''
+            for digit in display.digits:
+                if digit in chars:
+                    res = chars[digit]
+                else:
+                    res = digit.detect()
+
+                value += res if res is not None else ' '
+
+            values[display.name] = value
+            if cache is not None and ' ' not in value:
+                cache.remember(display.name, rois[display.name], value)
+
+        return values
+
     @staticmethod
     def __parse_time(time_str: str) -> int:
         if time_str == "----":
@@ -129,25 +239,61 @@ class SkyWalker():
         return total_seconds
 
     def detect(self) -> Optional[Result]:
-        processed_image = self.__preprocess_image()
+        layout_cache = self.ctx.layout
+        layout = layout_cache.get() if layout_cache is not None else None
+
+        if layout is not None:
+            self.ctx.images.restrict(layout.bounds())
 
-        displays = self.__detect_displays(processed_image)
+            with self.ctx.timer.stage('layout_check'):
+                valid = layout.is_valid(self.ctx.images.binary)
+
+            if not valid:
+                _debug(self.ctx, lambda: print(f'{self.ctx.name} cached layout changed', file=sys.stderr))
+                layout_cache.invalidate()
+                layout = None
+                self.ctx.images.unrestrict()
+
+        if layout is not None:
+            displays = self.__restore_displays(layout)
+        else:
+            regions = None
+            if self.ctx.options.coarse_scale > 0:
+                with self.ctx.timer.stage('locate_panel'):
+                    regions = self.__locate_panel(self.ctx.options.coarse_scale)
+
+            aois = self.__find_aois(regions)
+
+            with self.ctx.timer.stage('detect_displays'):
+                displays = self.__detect_displays(aois)
+
+            if displays and regions is not None:
+                # the digits are read from the area of the displays found, not from the cluster each was found in
+                self.ctx.images.restrict(RectSet.from_rects([display.rect for display in displays.values()] + 
+                                                           [digit.rect for display in displays.values() for digit in display.digits]).bounds())
 
         if not displays:
-            print('skywalker display not found')
+            print('skywalker display not found', file=sys.stderr)
             return None
 
         if not 'POWER' in displays:
-            print('skywalker power display not found')
+            print('skywalker power display not found', file=sys.stderr)
             return None
         
         _debug(self.ctx, lambda: _debug_displays(self.ctx, {key: disp.rect for key, disp in displays.items()}))
                 
+        with self.ctx.timer.stage('detect_values'):
+            values = self.__detect_values(displays, layout_cache if layout is not None else None)
+
         res:Result = Result(self.ctx.name)
+        res.displays = list(displays)
         for display in displays.values():
             if not display.skip_detect:
-                value = display.detect()
-                _debug(self.ctx, lambda: print(f'{self.ctx.name}-{display.name}: {value}'))
+                value = values[display.name]
+                _debug(self.ctx, lambda: print(f'{self.ctx.name}-{display.name}: {value}', file=sys.stderr))
+
+                if ' ' in value:
+                    res.fail(display.name, f'unrecognized digit ({value})')
 
             try:
                 match display.name:
@@ -165,6 +311,13 @@ class SkyWalker():
                         res.mode = display.name.removeprefix('MODE_')
 
             except ValueError as e:
-                print(f'{self.ctx.name} - {display.name} failed to convert result ({value}): {e}')
+                print(f'{self.ctx.name} - {display.name} failed to convert result ({value}): {e}', file=sys.stderr)
+                res.fail(display.name, str(e))
+
+        if layout_cache is not None:
+            if layout is None and res.is_valid():
+                layout_cache.update(self.__snapshot_layout(displays))
+            elif layout is not None and not res.is_valid():
+                layout_cache.invalidate()
 
         return res
@@ -1,60 +1,87 @@
 
 import math
-from typing import Callable, Tuple
+import sys
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
 import cv2
 import numpy as np
-from context import FrameContext
+from context import FrameContext, FrameImages
 from debug import _debug
 from utils import area
 
 class Mask:
-    def __init__(self, box: list[list], arr: np.array):
+    def __init__(self, box: list[list], arr: np.array, crop: np.array = None):
         self.box = box
         self.array = arr
+        self.crop = crop
+
+class MaskCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__items: OrderedDict[Hashable, object] = OrderedDict()
+
+    def get(self, key: Hashable, factory: Callable[[], object]) -> object:
+        if key in self.__items:
+            self.hits += 1
+            self.__items.move_to_end(key)
+            return self.__items[key]
+
+        self.misses += 1
+        value = factory()
+        self.__items[key] = value
+
+        if len(self.__items) > self.maxsize:
+            self.__items.popitem(last=False)
+
+        return value
+
+    def info(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.__items), 'maxsize': self.maxsize}
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self.__items.clear()
 
 class Segment:
     def __init__(self, 
                 name: str, 
                 filter: Callable[[cv2.Mat, list[list]], list[list]],
-                mask: Callable[[FrameContext, cv2.Mat], Tuple[cv2.Mat, Mask]] = None):
+                points: list[list[float]]):
         self.name = name
         self.filter = filter
-        self.mask = mask
+        self.points = points
+        self.mask = SSD._segment_mask(name, points)
+
+    def coords(self, w: int, h: int) -> np.ndarray:
+        return np.array([[int(p0 * (w - 1)), int(p1 * (h - 1))] for p0, p1 in self.points], dtype=np.int32)
+
+class DigitCrop:
+    def __init__(self, name: str, index: int, image: cv2.Mat, processed: cv2.Mat):
+        self.name = name
+        self.index = index
+        self.image = image
+        self.processed = processed
 
 class SSD:
     __instance = None 
-    __patterns : dict[str, str] = {}
     __zones = {}
+    # zone masks only depend on the digit size, which is shared by all digits after Display.fix_digits_size
+    __zone_masks = MaskCache(128)
+    __zone_stacks = MaskCache(16)
+
+    # minimum lit fraction of a zone for the mask engine to turn its segment on
+    fill_ratio = 0.45
 
     def __new__(cls):
         if cls.__instance is None:
             cls.__instance = super().__new__(cls)
-            cls.__init_patterns()
             cls.__init_zones()
         
         return cls.__instance
 
-    @classmethod
-    def __init_patterns(cls):
-        cls.__patterns = {
-            "0000000": None,
-            "1111110": '0',
-            "0110000": '1',
-            "1101101": '2',
-            "1111001": '3',
-            "0110011": '4',
-            "1011011": '5',
-            "1011111": '6',
-            "1110000": '7',
-            "1111111": '8',
-            "1111011": '9',
-            "1110111": 'A',
-            "1000110": 'T',
-            "1001110": 'C',
-            "0001110": 'L',
-            "0000001": '-',
-        }
-
     @classmethod
     def __horizontal_filter(cls, image: cv2.Mat, boxes: list[list]) -> cv2.Mat:
         return [box for box in boxes if box[2] >= 0.5 * image.shape[1] or \
@@ -66,10 +93,8 @@ class SSD:
                                          area(box[2], box[3]) >= 0.5 * area(image.shape[1], image.shape[0])]
     
     @classmethod
-    def _segment_mask(cls, points: list[list[int]]) -> Callable[[cv2.Mat], cv2.Mat]:
-        def __apply_mask(ctx: FrameContext, name: str, zone_name: str, image: cv2.Mat) -> Tuple[cv2.Mat, Mask]:
-            h, w = image.shape
-
+    def _segment_mask(cls, zone_name: str, points: list[list[int]]) -> Callable[[cv2.Mat], cv2.Mat]:
+        def __build_mask(h: int, w: int) -> Mask:
             w -= 1 
             h -= 1
             
@@ -89,67 +114,229 @@ class SSD:
 
                 coords.append([x, y])
                 
-            mask = np.zeros_like(image, dtype=np.uint8)
+            mask = np.zeros((h + 1, w + 1), dtype=np.uint8)
             arr = np.array(coords, dtype=np.int32)
             cv2.fillPoly(mask, [arr], 255)
 
-            masked = cv2.bitwise_and(image, image, mask=mask)
-            zoned = masked[min_y:max_y, min_x:max_x]
-            
+            return Mask([min_x, min_y, max_x - min_x, max_y - min_y], arr, mask[min_y:max_y, min_x:max_x].copy())
 
-            return zoned, Mask([min_x, min_y, max_x - min_x, max_y - min_y], arr) 
+        def __apply_mask(ctx: FrameContext, name: str, zone_idx: str, image: cv2.Mat) -> Tuple[cv2.Mat, Mask]:
+            h, w = image.shape
+            mask = cls.__zone_masks.get((zone_name, h, w), lambda: __build_mask(h, w))
+
+            x, y, mw, mh = mask.box
+            cropped = image[y:y+mh, x:x+mw]
+            zoned = cv2.bitwise_and(cropped, cropped, mask=mask.crop)
+
+            return zoned, mask
 
         return __apply_mask
 
+    @classmethod
+    def cache_info(cls) -> dict[str, dict[str, int]]:
+        return {'zone_masks': cls.__zone_masks.info(), 'zone_stacks': cls.__zone_stacks.info()}
 
     @classmethod
     def __init_zones(cls):
         cls.__zones = {
             "top": Segment("top", 
                         cls.__horizontal_filter,
-                        cls._segment_mask([[0,0], [1,0], [0.5, 0.25]])),
+                        [[0,0], [1,0], [0.5, 0.25]]),
             "top-right": Segment("top-right", 
                         cls.__vertical_filter,
-                        cls._segment_mask([[1,0], [1,0.5], [0.5, 0.25]])),
+                        [[1,0], [1,0.5], [0.5, 0.25]]),
             "bottom-right": Segment("bottom-right",
                         cls.__vertical_filter,
-                        cls._segment_mask([[1,0.5], [1,1], [0.5, 0.75]])),
+                        [[1,0.5], [1,1], [0.5, 0.75]]),
             "bottom": Segment("bottom", 
                         cls.__horizontal_filter,
-                        cls._segment_mask([[0,1], [1,1], [0.5, 0.75]])),
+                        [[0,1], [1,1], [0.5, 0.75]]),
             "bottom-left": Segment("bottom-left",
                         cls.__vertical_filter,
-                        cls._segment_mask([[0,1], [0,0.5], [0.5, 0.75]])),
+                        [[0,1], [0,0.5], [0.5, 0.75]]),
             "top-left": Segment("top-left", 
                         cls.__vertical_filter,
-                        cls._segment_mask([[0,0], [0,0.5], [0.5, 0.25]])),
+                        [[0,0], [0,0.5], [0.5, 0.25]]),
             "middle": Segment("middle", 
                         cls.__horizontal_filter,
-                        cls._segment_mask([[0,0.5], [0.5,0.25], [1, 0.5], [0.5, 0.75]])),
+                        [[0,0.5], [0.5,0.25], [1, 0.5], [0.5, 0.75]]),
         }
 
     @staticmethod
-    def __preprocess_image(image: cv2.Mat) -> cv2.Mat:
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def preprocess(image: cv2.Mat, level: int = 200, ksize: int = 5) -> cv2.Mat:
+        gray_image = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-        _, threshold_image = cv2.threshold(gray_image, 200, 255, cv2.THRESH_BINARY) 
+        _, threshold_image = cv2.threshold(gray_image, level, 255, cv2.THRESH_BINARY) 
 
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5)) 
+        kernel = FrameImages.kernel(ksize)
         dilated = cv2.dilate(threshold_image , kernel, iterations=1)
         closed = cv2.morphologyEx(dilated, cv2.MORPH_CLOSE, kernel)
 
         return closed
 
+    @staticmethod
+    def preprocess_batch(images: list[cv2.Mat], level: int = 200, ksize: int = 5, padding: Optional[int] = None) -> list[cv2.Mat]:
+        # stack same-sized digits into one mosaic separated by dark rows, so the color conversion,
+        # threshold and morphology run once per batch instead of once per digit.
+        # the dilation and the closing each reach ksize / 2 rows into a gap from both sides, so a gap of
+        # twice the kernel keeps neighbouring digits from touching
+        if padding is None:
+            padding = 2 * ksize
+
+        groups: dict[tuple, list[int]] = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+
+        processed: list[cv2.Mat] = [None] * len(images)
+        for shape, indices in groups.items():
+            h = shape[0]
+            gap = np.zeros((padding,) + shape[1:], dtype=images[indices[0]].dtype)
+            mosaic = np.concatenate([part for i in indices for part in (images[i], gap)])
+            processed_mosaic = SSD.preprocess(mosaic, level, ksize)
+
+            for n, i in enumerate(indices):
+                y = n * (h + padding)
+                processed[i] = processed_mosaic[y:y+h]
+
+        return processed
+
     @classmethod
-    def detect(cls, ctx: FrameContext, name:str, idx: int, image: cv2.Mat) -> str:
-        processed_image = SSD.__preprocess_image(image)
+    def __zone_stack(cls, shape: Tuple[int, int]) -> np.ndarray:
+        return cls.__zone_stacks.get(shape, lambda: cls.__build_zone_stack(shape))
+
+    @classmethod
+    def __build_zone_stack(cls, shape: Tuple[int, int]) -> np.ndarray:
+        # one row per zone, normalized by the zone area so a dot product gives the lit fraction
+        h, w = shape
+        masks = np.zeros((len(cls.__zones), h, w), dtype=np.uint8)
+        for i, zone in enumerate(cls.__zones.values()):
+            cv2.fillPoly(masks[i], [zone.coords(w, h)], 1)
+
+        stack = masks.reshape(len(cls.__zones), -1).astype(np.float32)
+        stack /= np.maximum(stack.sum(axis=1, keepdims=True), 1)
+
+        return stack
+
+    @classmethod
+    def __segments(cls, ratios: np.ndarray) -> str:
+        return ''.join('1' if ratio >= cls.fill_ratio else '0' for ratio in ratios)
+
+    @classmethod
+    def __debug_masks(cls, ctx: FrameContext, name:str, idx: int, image: cv2.Mat, segments: str):
+        debug_image = image.copy()
+        h, w = debug_image.shape[:2]
+        for zone, segment in zip(cls.__zones.values(), segments):
+            cv2.polylines(debug_image, [zone.coords(w, h)], True, (0, 255, 0) if segment == '1' else (0, 0, 255), 1)
+        ctx._write_step(f'{name}-{idx}-diag', debug_image)
+
+    @classmethod
+    def __detect_masks(cls, ctx: FrameContext, name:str, idx: int, image: cv2.Mat, processed_image: cv2.Mat) -> str:
+        stack = cls.__zone_stack(processed_image.shape)
+        ratios = stack @ (processed_image.reshape(-1) > 0).astype(np.float32)
+
+        segments = cls.__segments(ratios)
+
+        _debug(ctx, lambda: cls.__debug_masks(ctx, name, idx, image, segments))
 
+        return segments
+
+    @classmethod
+    def __lookup(cls, ctx: FrameContext, name:str, idx: int, segments: str) -> str:
+        _debug(ctx, lambda: print(f'{ctx.name}-{name}-{idx} pattern {segments}', file=sys.stderr))
+
+        # glyphs of the panel profile
+        patterns = ctx.options.panel.patterns
+        if segments in patterns:
+            return patterns[segments]
+
+    @classmethod
+    def classify(cls, ctx: FrameContext, name:str, idx: int, image: cv2.Mat, processed_image: cv2.Mat) -> str:
         ctx._write_step(f'{name}-{idx}', processed_image)
-           
+
+        if ctx.options.ssd_engine == 'mask':
+            segments = cls.__detect_masks(ctx, name, idx, image, processed_image)
+        else:
+            segments = cls.__detect_contours(ctx, name, idx, image, processed_image)
+
+        return cls.__lookup(ctx, name, idx, segments)
+
+    @classmethod
+    def classify_batch(cls, ctx: FrameContext, digits: list[DigitCrop]) -> list[str]:
+        if ctx.options.ssd_engine != 'mask':
+            return [cls.classify(ctx, d.name, d.index, d.image, d.processed) for d in digits]
+
+        # digits of the same size are classified together with one matrix product
+        groups: dict[Tuple[int, int], list[int]] = {}
+        for i, digit in enumerate(digits):
+            groups.setdefault(digit.processed.shape, []).append(i)
+
+        results: list[str] = [None] * len(digits)
+        for shape, indices in groups.items():
+            stack = cls.__zone_stack(shape)
+            lit = np.stack([digits[i].processed for i in indices]).reshape(len(indices), -1) > 0
+            ratios = lit.astype(np.float32) @ stack.T
+
+            for i, digit_ratios in zip(indices, ratios):
+                digit = digits[i]
+                ctx._write_step(f'{digit.name}-{digit.index}', digit.processed)
+
+                segments = cls.__segments(digit_ratios)
+                _debug(ctx, lambda: cls.__debug_masks(ctx, digit.name, digit.index, digit.image, segments))
+
+                results[i] = cls.__lookup(ctx, digit.name, digit.index, segments)
+
+        return results
+
+    @classmethod
+    def search(cls, ctx: FrameContext, name: str, idx: int, processed_strip: cv2.Mat, width: int, 
+               max_candidates: int = 32) -> Tuple[str, int]:
+        h, strip_width = processed_strip.shape
+        count = strip_width - width + 1
+        if count <= 0:
+            return None, 0
+
+        stack = cls.__zone_stack((h, width))
+        windows = np.lib.stride_tricks.sliding_window_view(processed_strip > 0, width, axis=1)
+
+        def __best(offsets: list[int]) -> Tuple[float, int, str]:
+            lit = windows[:, offsets, :].transpose(1, 0, 2).reshape(len(offsets), -1).astype(np.float32)
+            ratios = lit @ stack.T
+
+            best = (-1.0, offsets[0], None)
+            for offset, digit_ratios in zip(offsets, ratios):
+                char = ctx.options.panel.patterns.get(cls.__segments(digit_ratios))
+                if char is None:
+                    continue
+
+                # distance of the least certain zone from the fill threshold
+                score = float(np.min(np.abs(digit_ratios - cls.fill_ratio)))
+                if score > best[0]:
+                    best = (score, offset, char)
+
+            return best
+
+        # coarse pass capped to max_candidates windows, then refine around the best coarse offset
+        step = max(1, math.ceil(count / max_candidates))
+        score, offset, char = __best(list(range(0, count, step)))
+        if step > 1:
+            score, offset, char = max((score, offset, char), 
+                                      __best(list(range(max(offset - step + 1, 0), min(offset + step, count)))),
+                                      key=lambda best: best[0])
+
+        _debug(ctx, lambda: ctx._write_step(f'{name}-{idx}', processed_strip[:, offset:offset + width]))
+
+        return char, offset
+
+    @classmethod
+    def detect(cls, ctx: FrameContext, name:str, idx: int, image: cv2.Mat) -> str:
+        return cls.classify(ctx, name, idx, image, SSD.preprocess(image, ctx.options.panel.threshold, ctx.options.panel.digit_kernel))
+
+    @classmethod
+    def __detect_contours(cls, ctx: FrameContext, name:str, idx: int, image: cv2.Mat, processed_image: cv2.Mat) -> str:
         segments = ''
         i = 0
         
-        if ctx.options.debug:
+        if ctx.debug:
             debug_image = image.copy()
 
         for zone in cls.__zones.values():
@@ -192,8 +379,6 @@ class SSD:
             i+=1
         
         _debug(ctx, lambda: ctx._write_step(f'{name}-{idx}-diag', debug_image))
-        _debug(ctx, lambda: print(f'{ctx.name}-{name}-{idx} pattern {segments}'))
 
-        if segments in cls.__patterns:
-            return cls.__patterns[segments]
+        return segments
 
@@ -0,0 +1,140 @@
+import math
+from typing import Optional, Tuple
+import cv2
+import numpy as np
+
+from panel import BLANK, DEFAULT_PROFILE, load_profile
+
+# glyphs and section geometry of the default profile, so the benchmarks render the panel the detection expects
+_PROFILE = load_profile(DEFAULT_PROFILE)
+
+GLYPHS = {' ': BLANK, **_PROFILE.glyphs}
+
+# angle and length ratio (of the POWER digit height) of each display from the POWER display
+LAYOUT = {section.name: (section.angle, section.length) for section in _PROFILE.sections.values()}
+
+LIT = (255, 235, 225)
+UNLIT = (60, 40, 40)
+BACKGROUND = (25, 12, 10)
+
+class Panel:
+    def __init__(self, temperature: str = '197', profile: str = '008', power: str = '80', fan: str = '45', time: str = '0216', mode: str = 'ROAST'):
+        self.temperature = temperature
+        self.profile = profile
+        self.power = power
+        self.fan = fan
+        self.time = time
+        self.mode = mode
+
+def _segment_polygons(x: int, y: int, w: int, h: int, t: int) -> list[np.ndarray]:
+    g = max(1, t // 4)
+    hm = h // 2
+    boxes = [
+        [x + g, y, x + w - g, y + t],                       # top
+        [x + w - t, y + g, x + w, y + hm - g],              # top-right
+        [x + w - t, y + hm + g, x + w, y + h - g],          # bottom-right
+        [x + g, y + h - t, x + w - g, y + h],               # bottom
+        [x, y + hm + g, x + t, y + h - g],                  # bottom-left
+        [x, y + g, x + t, y + hm - g],                      # top-left
+        [x + g, y + hm - t // 2, x + w - g, y + hm + t - t // 2],  # middle
+    ]
+    return [np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.int32) for x1, y1, x2, y2 in boxes]
+
+def draw_digit(image: cv2.Mat, x: int, y: int, w: int, h: int, char: str, lit: Tuple = LIT, unlit: Optional[Tuple] = UNLIT):
+    glyph = GLYPHS[char]
+    thickness = max(2, int(w * 0.22))
+    for on, polygon in zip(glyph, _segment_polygons(x, y, w, h, thickness)):
+        if on == '1':
+            cv2.fillPoly(image, [polygon], lit)
+        elif unlit is not None:
+            cv2.fillPoly(image, [polygon], unlit)
+
+def render_digit(char: str, w: int = 50, h: int = 80, margin: int = 6) -> cv2.Mat:
+    image = np.full((h + margin * 2, w + margin * 2, 3), BACKGROUND, dtype=np.uint8)
+    draw_digit(image, margin, margin, w, h, char)
+    return image
+
+def _display_text(panel: Panel, name: str) -> Optional[str]:
+    match name:
+        case "TEMPERATURE":
+            return panel.temperature
+        case "PROFILE":
+            return panel.profile
+        case "POWER":
+            return panel.power
+        case "FAN":
+            return panel.fan
+        case "TIME":
+            return panel.time
+    return None
+
+def render_panel(panel: Panel, 
+                 digit_height: int = 80, 
+                 size: Tuple[int, int] = (1920, 1080), 
+                 noise: float = 0, 
+                 blur: int = 0, 
+                 glare: float = 0, 
+                 seed: Optional[int] = None,
+                 colon_gap: Optional[int] = None,
+                 layout: dict[str, Tuple[float, float]] = LAYOUT) -> cv2.Mat:
+    rng = np.random.default_rng(seed)
+    width, height = size
+    image = np.full((height, width, 3), BACKGROUND, dtype=np.uint8)
+
+    digit_width = int(digit_height * 0.62)
+    gap = int(digit_height * 0.2)
+    colon = int(digit_height * 0.12)
+    colon_gap = gap if colon_gap is None else colon_gap
+
+    # AOIs are measured on the dilated threshold image, which grows every blob by the 10x10 kernel
+    unit = digit_height + 9
+    power_center = (int(width * 0.47), int(height * 0.4))
+
+    for name, (angle, length) in layout.items():
+        cx = power_center[0] + unit * length * math.cos(math.radians(angle))
+        cy = power_center[1] + unit * length * math.sin(math.radians(angle))
+
+        if name.startswith('MODE_'):
+            if name.removeprefix('MODE_') != panel.mode:
+                continue
+
+            side = int(digit_height * 0.5)
+            x = int(cx + (side + 9) - side - 5)
+            y = int(cy - side / 2)
+            cv2.rectangle(image, (x, y), (x + side, y + side), LIT, -1)
+            cv2.rectangle(image, (x + side // 4, y + side // 4), (x + side - side // 4, y + side // 2), BACKGROUND, -1)
+            continue
+
+        text = _display_text(panel, name)
+        text_width = len(text) * digit_width + (len(text) - 1) * gap
+        if name == "TIME":
+            text_width += colon + colon_gap * 2 - gap
+
+        projected_width = max(text_width + 9, unit * 2)
+        x2 = int(cx + projected_width / 2) - 5
+        y = int(cy - unit / 2) + 4
+
+        x = x2 - text_width
+        for i, char in enumerate(text):
+            draw_digit(image, x, y, digit_width, digit_height, char)
+            x += digit_width + (colon_gap if name == "TIME" and i == 1 else gap)
+            if name == "TIME" and i == 1:
+                cv2.rectangle(image, (x, y + digit_height // 4), (x + colon, y + digit_height // 4 + colon), LIT, -1)
+                cv2.rectangle(image, (x, y + digit_height * 3 // 4 - colon), (x + colon, y + digit_height * 3 // 4), LIT, -1)
+                x += colon + colon_gap
+
+    if glare > 0:
+        overlay = np.zeros_like(image)
+        gx = int(rng.uniform(0.2, 0.8) * width)
+        gy = int(rng.uniform(0.1, 0.6) * height)
+        cv2.ellipse(overlay, (gx, gy), (int(width * 0.12), int(height * 0.02)), rng.uniform(-20, 20), 0, 360, (255, 255, 255), -1)
+        overlay = cv2.GaussianBlur(overlay, (0, 0), digit_height * 0.2)
+        image = cv2.addWeighted(image, 1, overlay, glare, 0)
+
+    if blur > 0:
+        image = cv2.GaussianBlur(image, (blur * 2 + 1, blur * 2 + 1), 0)
+
+    if noise > 0:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+
+    return image
@@ -0,0 +1,113 @@
+import sys
+from typing import Optional
+
+from failures import TEMPERATURE_RATE, TEMPERATURE_STEP
+from output import Result2
+from skywalker import Result
+from utils import frame_seconds
+
+# the TIME display may lead or lag the video clock by this many seconds
+TIME_TOLERANCE = 2
+MAX_POWER = 100
+MAX_FAN = 100
+
+class AdaptiveStride:
+    def __init__(self, interval: int, max_interval: int):
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.current = interval
+
+    def __call__(self) -> int:
+        return self.current
+
+    def update(self, changed: bool):
+        # sample densely around changes, back off while the displays hold still
+        self.current = self.interval if changed else min(self.current * 2, self.max_interval)
+
+class TemporalFilter:
+    def __init__(self, correct: bool = True, confirm: int = 2, stride: Optional[AdaptiveStride] = None):
+        self.correct = correct
+        # frames a temperature jump has to persist for before it is believed
+        self.confirm = confirm
+        self.stride = stride
+
+        self.__prev: Optional[Result] = None
+        self.__prev_sec = 0
+        self.__candidate: Optional[int] = None
+        self.__candidate_count = 0
+
+    def apply(self, line: Optional[Result2]) -> Optional[Result2]:
+        # called with the frames in order
+        if line is None:
+            return None
+
+        res = line.result
+        sec = frame_seconds(res.name)
+        prev = self.__prev
+
+        if self.correct and prev is not None and sec is not None and res.mode == prev.mode:
+            self.__correct(res, prev, sec - self.__prev_sec)
+
+        if self.stride is not None:
+            self.stride.update(prev is None or TemporalFilter.__changed(prev, res))
+
+        if res.is_valid() and sec is not None:
+            self.__prev = res
+            self.__prev_sec = sec
+
+        return line
+
+    @staticmethod
+    def __changed(prev: Result, res: Result) -> bool:
+        return (prev.temperature, prev.profile, prev.power, prev.fan, prev.mode) != \
+            (res.temperature, res.profile, res.power, res.fan, res.mode)
+
+    def __correct(self, res: Result, prev: Result, dt: int):
+        failed = set(res.errors)
+        corrected: dict[str, tuple] = {}
+
+        # the timer only counts up within a roast phase, a read that drifts from the video clock is kept
+        # (the stride or frame rate may be off, or the roast paused) and only flagged
+        expected = prev.time + dt
+        if 'TIME' in failed or res.time < prev.time:
+            corrected['TIME'] = (res.time, expected)
+            res.time = expected
+        elif abs(res.time - expected) > TIME_TOLERANCE:
+            print(f'{res.name} TIME {res.time} drifted from {expected}', file=sys.stderr)
+
+        if 'TEMPERATURE' in failed:
+            corrected['TEMPERATURE'] = (res.temperature, prev.temperature)
+            res.temperature = prev.temperature
+        elif abs(res.temperature - prev.temperature) > TEMPERATURE_STEP + TEMPERATURE_RATE * dt:
+            # hold the last value until the jump is seen on consecutive frames
+            if self.__candidate is not None and abs(res.temperature - self.__candidate) <= TEMPERATURE_STEP:
+                self.__candidate_count += 1
+            else:
+                self.__candidate = res.temperature
+                self.__candidate_count = 1
+
+            if self.__candidate_count < self.confirm:
+                corrected['TEMPERATURE'] = (res.temperature, prev.temperature)
+                res.temperature = prev.temperature
+            else:
+                self.__candidate = None
+        else:
+            self.__candidate = None
+
+        if 'POWER' in failed or res.power > MAX_POWER:
+            corrected['POWER'] = (res.power, prev.power)
+            res.power = prev.power
+
+        if 'FAN' in failed or res.fan > MAX_FAN:
+            corrected['FAN'] = (res.fan, prev.fan)
+            res.fan = prev.fan
+
+        if 'PROFILE' in failed:
+            corrected['PROFILE'] = (res.profile, prev.profile)
+            res.profile = prev.profile
+
+        if len(corrected) > 0:
+            for name in corrected:
+                res.errors.pop(name, None)
+            # stderr, stdout may be the stdout output
+            print(f'{res.name} corrected ' + ', '.join(f'{name} {old} -> {new}' for name, (old, new) in corrected.items()), file=sys.stderr)
@@ -0,0 +1,84 @@
+import contextlib
+import json
+import os
+import time
+from typing import Iterator, Optional, TextIO, Tuple, TypeVar
+import numpy as np
+
+from utils import print_table
+
+T = TypeVar('T')
+
+# (stage, start, duration) in perf_counter seconds, the clock is shared by the worker processes
+Span = Tuple[str, float, float]
+
+class _Stage:
+    __slots__ = ('spans', 'name', 'start')
+
+    def __init__(self, spans: list[Span], name: str):
+        self.spans = spans
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.spans.append((self.name, self.start, time.perf_counter() - self.start))
+
+_disabled = contextlib.nullcontext()
+
+class StageTimer:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.spans: list[Span] = []
+
+    def stage(self, name: str):
+        return _Stage(self.spans, name) if self.enabled else _disabled
+
+class TimingReport:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.__events: list[Tuple[str, Span, int]] = []
+
+    def add(self, frame: str, spans: list[Span], pid: Optional[int] = None):
+        pid = pid if pid is not None else os.getpid()
+        self.__events += [(frame, span, pid) for span in spans]
+
+    def timed(self, iterator: Iterator[T], stage: str) -> Iterator[T]:
+        # times every step of the iterator, e.g. decoding the next frame
+        while True:
+            t1 = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+
+            self.add('', [(stage, t1, time.perf_counter() - t1)])
+            yield item
+
+    def summary(self) -> list[list]:
+        durations: dict[str, list[float]] = {}
+        for _, (stage, _, duration), _ in self.__events:
+            durations.setdefault(stage, []).append(duration * 1000)
+
+        rows = []
+        for stage, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            rows.append([stage, len(values), round(sum(values), 1), round(float(np.mean(values)), 2),
+                         round(float(p50), 2), round(float(p90), 2), round(float(p99), 2), round(max(values), 2)])
+
+        return rows
+
+    def print_summary(self, file: Optional[TextIO] = None):
+        headers = ['stage', 'count', 'total (msec)', 'mean', 'p50', 'p90', 'p99', 'max']
+        print_table(headers, self.summary(), file)
+
+    def write_trace(self, path: str):
+        # chrome://tracing (or Perfetto) complete events, one row per process
+        events = [{'name': stage, 'ph': 'X', 'pid': pid, 'tid': pid,
+                   'ts': round((start - self.start) * 1e6, 1), 'dur': round(duration * 1e6, 1),
+                   'args': {'frame': frame}}
+                  for frame, (stage, start, duration), pid in self.__events]
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -1,10 +1,37 @@
 
 import math
-from typing import Optional, Tuple
+from typing import Optional, TextIO, Tuple, Union
 import cv2
 import numpy as np
 
+class AllocationCounter:
+    def __init__(self):
+        self.views = 0
+        self.copies = 0
+        self.bytes = 0
+
+    def view(self):
+        self.views += 1
+
+    def copy(self, image: cv2.Mat) -> cv2.Mat:
+        self.copies += 1
+        self.bytes += image.nbytes
+        return image.copy()
+
+    def reset(self):
+        self.views = 0
+        self.copies = 0
+        self.bytes = 0
+
+    def info(self) -> dict[str, int]:
+        return {'views': self.views, 'copies': self.copies, 'bytes': self.bytes}
+
+# image extractions, reset per frame and reported by `benchmark.py pipeline` to check how much memory is copied
+allocations = AllocationCounter()
+
 class Rect:
+    __slots__ = ('x', 'y', 'w', 'h')
+
     def __init__(self, rect:list):
         self.x = rect[0]
         self.y = rect[1]
@@ -66,8 +93,9 @@ class Rect:
         xmin = min(xmin, self.x)
         return Rect([xmin ,self.y, wmax, self.h])
     
-    def extract_image(self, image: cv2.Mat) -> Optional[cv2.Mat]:
-        image_height, image_width, _ = image.shape
+    def extract_image(self, image: cv2.Mat, copy: bool = False) -> Optional[cv2.Mat]:
+        # returns a view into image, pass copy=True when the caller modifies the result
+        image_height, image_width = image.shape[:2]
 
         if self.x >= image_width or \
             self.y >= image_height:
@@ -76,12 +104,129 @@ class Rect:
         w = min(self.w, image_width)
         h = min(self.h, image_height)
 
-        return image[self.y:self.y+h, self.x:self.x+w].copy()
+        roi = image[self.y:self.y+h, self.x:self.x+w]
+        if copy:
+            return allocations.copy(roi)
+
+        allocations.view()
+        return roi
             
 
 
-def find_central_box_index(rects: list[Rect]):
-    centers = np.array([rect.center() for rect in rects])
+class RectSet:
+    # structure of arrays for geometry over many rects at once, one (n, 4) array of x, y, w, h
+    def __init__(self, boxes: np.ndarray):
+        self.boxes = boxes.reshape(-1, 4).astype(np.int32, copy=False)
+
+    @classmethod
+    def from_rects(cls, rects: list[Rect]):
+        return cls(np.array([(rect.x, rect.y, rect.w, rect.h) for rect in rects], dtype=np.int32))
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __getitem__(self, index: int) -> Rect:
+        return Rect([int(v) for v in self.boxes[index]])
+
+    def rects(self) -> list[Rect]:
+        return [Rect(box) for box in self.boxes.tolist()]
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.boxes[:, 0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.boxes[:, 1]
+
+    @property
+    def w(self) -> np.ndarray:
+        return self.boxes[:, 2]
+
+    @property
+    def h(self) -> np.ndarray:
+        return self.boxes[:, 3]
+
+    def x2(self) -> np.ndarray:
+        return self.x + self.w
+
+    def y2(self) -> np.ndarray:
+        return self.y + self.h
+
+    def centers(self) -> np.ndarray:
+        return np.stack([self.x + self.w // 2, self.y + self.h // 2], axis=1)
+
+    def projected(self):
+        # Rect.projected for every rect
+        wmax = np.maximum(self.w, self.h * 2)
+        xmin = np.minimum(self.x + self.w - wmax, self.x)
+        return RectSet(np.stack([xmin, self.y, wmax, self.h], axis=1))
+
+    def bounds(self) -> Rect:
+        x, y = self.x.min(), self.y.min()
+        return Rect([int(x), int(y), int(self.x2().max() - x), int(self.y2().max() - y)])
+
+    def overlapped(self, rect: Rect) -> np.ndarray:
+        # Rect.overlapped of every rect with rect
+        inter_w = np.minimum(self.x2(), rect.x2()) - np.maximum(self.x, rect.x)
+        inter_h = np.minimum(self.y2(), rect.y2()) - np.maximum(self.y, rect.y)
+        inter = np.where((inter_w > 0) & (inter_h > 0), inter_w * inter_h, 0)
+        return inter / np.maximum(np.minimum(self.w * self.h, rect.area()), 1)
+
+    def merged(self):
+        # bounds of the rects that chain together by overlapping, repeated until no two bounds overlap
+        boxes = self.boxes
+        done = np.empty((0, 4), dtype=np.int32)
+        while len(boxes) > 0:
+            group, boxes = boxes[:1], boxes[1:]
+            while True:
+                bounds = RectSet(group).bounds()
+                hits, done_hits = RectSet(boxes).overlapped(bounds) > 0, RectSet(done).overlapped(bounds) > 0
+                if not hits.any() and not done_hits.any():
+                    break
+
+                group = np.concatenate([group, boxes[hits], done[done_hits]])
+                boxes, done = boxes[~hits], done[~done_hits]
+
+            done = np.concatenate([done, np.array([bounds.to_list()], dtype=np.int32)])
+
+        return RectSet(done)
+
+    def sort(self, key: np.ndarray):
+        return RectSet(self.boxes[np.argsort(key, kind='stable')])
+
+    def rows(self) -> list[np.ndarray]:
+        # indices of rects whose vertical extents chain together, a new row starts at the first
+        # rect (in y order) below every rect before it
+        if len(self) == 0:
+            return []
+
+        order = np.argsort(self.y, kind='stable')
+        y = self.y[order]
+        reach = np.maximum.accumulate(self.y2()[order])
+        starts = np.flatnonzero(y[1:] > reach[:-1]) + 1
+        return np.split(order, starts)
+
+ROTATIONS = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+def rotate_image(image: cv2.Mat, degree: int) -> cv2.Mat:
+    degree = degree % 360
+    if degree == 0:
+        return image
+
+    if degree not in ROTATIONS:
+        raise ValueError(f'unsupported rotation {degree}')
+
+    return cv2.rotate(image, ROTATIONS[degree])
+
+def find_central_box_index(rects: Union[list[Rect], RectSet]):
+    if not isinstance(rects, RectSet):
+        rects = RectSet.from_rects(rects)
+    centers = rects.centers()
 
     centroid = np.mean(centers, axis=0)
 
@@ -90,24 +235,18 @@ def find_central_box_index(rects: list[Rect]):
     return closest_index
 
 
-def calculate_projection(rect: Rect, ratio: float, angle: float) -> Tuple[int, int]:
-    x1, y1, w1, h1 = rect.to_list()
-    px, py = rect.projected().center()
-
-    angle_radians = math.radians(angle)
-    dx = h1 * ratio * math.cos(angle_radians)
-    dy = h1 * ratio * math.sin(angle_radians)
-    return (int(px + dx), int(py + dy))
+def find_projection_rect_index(pt2: Tuple[int, int], rects: Union[list[Rect], RectSet]) -> Optional[int]:
+    # first rect whose projected center is within twice its height of pt2
+    if not isinstance(rects, RectSet):
+        rects = RectSet.from_rects(rects)
+    if len(rects) == 0:
+        return None
 
-def find_projection_rect_index(pt2: Tuple[int, int], rects: list[Rect]) -> Optional[int]:
-    px, py = pt2 
-    for i, rect in enumerate(rects):
-        x, y = rect.projected().center()
-        distance = int(math.sqrt((((px - x) ** 2) + ((py - y) ** 2))))
-        if distance <= (rect.h * 2):
-            return i
+    centers = rects.projected().centers()
+    distances = np.hypot(centers[:, 0] - pt2[0], centers[:, 1] - pt2[1]).astype(np.int32)
+    matches = np.flatnonzero(distances <= rects.h * 2)
 
-    return None
+    return int(matches[0]) if len(matches) > 0 else None
 
 def calculate_angle(pt1, pt2):
     delta_x = pt2[0] - pt1[0]
@@ -236,9 +375,20 @@ def merge(rows, xthreshold = 100, ythreshold = 100):
 
 def extract_box(image, box):
     x, y, w, h = box
-    roi = image.copy()[y:y+h, x:x+w]
+    roi = allocations.copy(image[y:y+h, x:x+w])
 
     return roi
 
 def area(width: int, height: int) -> int:
     return width * height
+
+def print_table(headers: list[str], rows: list[list], file: Optional[TextIO] = None):
+    widths = [max(len(str(v)) for v in [h] + [row[i] for row in rows]) for i, h in enumerate(headers)]
+    print('  '.join(str(h).ljust(w) for h, w in zip(headers, widths)), file=file)
+    for row in rows:
+        print('  '.join(str(v).ljust(w) for v, w in zip(row, widths)), file=file)
+
+def frame_seconds(name: str) -> Optional[int]:
+    # video second of a 'frame_<sec>' name
+    sec = name.removeprefix('frame_')
+    return int(sec) if name.startswith('frame_') and sec.isdigit() else None
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterator, Optional, Tuple
+import cv2
+
+from context import Options
+
+DECODE_AUTO = 'auto'
+DECODE_SEEK = 'seek'
+DECODE_SEQUENTIAL = 'sequential'
+
+# gap between samples (in frames) from which a keyframe seek is cheaper than decoding forward
+SEEK_MIN_FRAMES = 150
+
+def open_video(path: str) -> cv2.VideoCapture:
+    video = cv2.VideoCapture(path)
+    if not video.isOpened():
+        raise ValueError(f"Cannot open video file: {path}")
+
+    return video
+
+def video_duration(path: str) -> float:
+    video = cv2.VideoCapture(path)
+    fps = video.get(cv2.CAP_PROP_FPS)
+    frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
+    video.release()
+
+    return frames / fps if fps > 0 else 0
+
+def choose_strategy(video: cv2.VideoCapture, interval: int, strategy: str = DECODE_AUTO) -> str:
+    if strategy != DECODE_AUTO:
+        return strategy
+
+    fps = video.get(cv2.CAP_PROP_FPS)
+    if fps <= 0:
+        return DECODE_SEEK
+
+    if interval * fps >= SEEK_MIN_FRAMES:
+        return DECODE_SEEK
+
+    return DECODE_SEQUENTIAL
+
+def seek_frames(video: cv2.VideoCapture, start: int, interval: int, stride: Optional[Callable[[], int]] = None) -> Iterator[Tuple[int, cv2.Mat]]:
+    cur_sec = start
+    while True:
+        video.set(cv2.CAP_PROP_POS_MSEC, cur_sec * 1000)
+        ret, frame = video.read()
+
+        if not ret:
+            break
+
+        yield cur_sec, frame
+        cur_sec += stride() if stride is not None else interval
+
+def sequential_frames(video: cv2.VideoCapture, start: int, interval: int, stride: Optional[Callable[[], int]] = None) -> Iterator[Tuple[int, cv2.Mat]]:
+    fps = video.get(cv2.CAP_PROP_FPS)
+    half_frame_msec = 500 / fps if fps > 0 else 0
+
+    if start > 0:
+        video.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+
+    cur_sec = start
+    while True:
+        if not video.grab():
+            break
+
+        # only decode the frames crossing the next sampling point
+        pos_msec = video.get(cv2.CAP_PROP_POS_MSEC)
+        if pos_msec + half_frame_msec < cur_sec * 1000:
+            continue
+
+        ret, frame = video.retrieve()
+        if not ret:
+            break
+
+        yield cur_sec, frame
+        cur_sec += stride() if stride is not None else interval
+
+def read_frames(video: cv2.VideoCapture, options: Options, stride: Optional[Callable[[], int]] = None) -> Iterator[Tuple[int, cv2.Mat]]:
+    # stride, when given, returns the gap to the next sample (e.g. growing while nothing changes)
+    strategy = choose_strategy(video, options.interval, options.decode)
+
+    if strategy == DECODE_SEQUENTIAL:
+        return sequential_frames(video, options.skip, options.interval, stride)
+
+    return seek_frames(video, options.skip, options.interval, stride)
+
+class LiveCapture:
+    def __init__(self, source: str, buffer_size: int = 2, loop: bool = False):
+        # a device index (e.g. 0 for /dev/video0) or a stream URL, a looping file stands in for a camera
+        self.video = cv2.VideoCapture(int(source) if source.isdigit() else source)
+        if not self.video.isOpened():
+            raise ValueError(f"Cannot open capture source: {source}")
+
+        self.loop = loop
+        self.dropped = 0
+
+        # the reader thread keeps only the newest frames, older ones are dropped instead of queued
+        self.__frames: deque[Tuple[float, cv2.Mat]] = deque(maxlen=max(1, buffer_size))
+        self.__ready = threading.Condition()
+        self.__running = True
+
+        self.__thread = threading.Thread(target=self.__read, daemon=True)
+        self.__thread.start()
+
+    def __read(self):
+        # a file decodes faster than real time, pace it like a camera would
+        fps = self.video.get(cv2.CAP_PROP_FPS)
+        period = 1 / fps if self.loop and fps > 0 else 0
+
+        while self.__running:
+            t1 = time.monotonic()
+            ret, frame = self.video.read()
+
+            if not ret:
+                if self.loop:
+                    self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                break
+
+            with self.__ready:
+                if len(self.__frames) == self.__frames.maxlen:
+                    self.dropped += 1
+                self.__frames.append((time.monotonic(), frame))
+                self.__ready.notify()
+
+            if period > 0:
+                time.sleep(max(0, period - (time.monotonic() - t1)))
+
+        with self.__ready:
+            self.__running = False
+            self.__ready.notify_all()
+
+    def latest(self, timeout: Optional[float] = None) -> Optional[Tuple[float, cv2.Mat]]:
+        with self.__ready:
+            self.__ready.wait_for(lambda: len(self.__frames) > 0 or not self.__running, timeout)
+            if len(self.__frames) == 0:
+                return None
+
+            self.dropped += len(self.__frames) - 1
+            captured, frame = self.__frames.pop()
+            self.__frames.clear()
+            return captured, frame
+
+    def running(self) -> bool:
+        with self.__ready:
+            return self.__running or len(self.__frames) > 0
+
+    def release(self):
+        with self.__ready:
+            self.__running = False
+        self.__thread.join()
+        self.video.release()
+
+def live_frames(capture: LiveCapture, interval: int, latency: float) -> Iterator[Tuple[int, cv2.Mat]]:
+    start = time.monotonic()
+    next_sample = start
+
+    while capture.running():
+        time.sleep(max(0, next_sample - time.monotonic()))
+
+        latest = capture.latest(timeout=max(1.0, interval))
+        if latest is None:
+            continue
+
+        captured, frame = latest
+        if time.monotonic() - captured > latency:
+            # already too old to be reported in time, wait for a fresh one
+            capture.dropped += 1
+            continue
+
+        yield max(0, round(captured - start)), frame
+        next_sample = max(next_sample + interval, time.monotonic())